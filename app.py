@@ -1,9 +1,59 @@
 # app.py
-from flask import Flask, render_template, request, jsonify
-from image_retrieval import create_moodboard
+import threading
+from flask import Flask, Response, render_template, request, jsonify
+from image_retrieval import ImageRetriever, create_moodboard, encode_texts
+from clip_loader import load_clip
+from text_batcher import TextEncodeBatcher
+from collage import CollageRenderer, validate_options
+from metrics import metrics
+from tag_index import validate_tag_filter
+from config import (
+    CLIP_MODEL_NAME, CLIP_QUANTIZE, TORCH_NUM_THREADS, TEXT_BATCH_MAX_SIZE, TEXT_BATCH_MAX_WAIT_MS, RETRIEVAL_INDEX,
+    SHARD_ADDRESSES
+)
 
 app = Flask(__name__)
 
+_text_batcher = None
+_text_batcher_lock = threading.Lock()
+_collage_renderer = None
+_live_index = None
+_live_index_lock = threading.Lock()
+
+def get_text_batcher():
+    """Load CLIP once per process and share it through a coalescing batcher"""
+    global _text_batcher
+    if _text_batcher is None:
+        with _text_batcher_lock:
+            if _text_batcher is None:
+                model, _, device = load_clip(CLIP_MODEL_NAME, quantize=CLIP_QUANTIZE, num_threads=TORCH_NUM_THREADS)
+                _text_batcher = TextEncodeBatcher(
+                    lambda texts: encode_texts(model, device, texts),
+                    max_batch_size=TEXT_BATCH_MAX_SIZE,
+                    max_wait_ms=TEXT_BATCH_MAX_WAIT_MS
+                )
+    return _text_batcher
+
+def get_live_index():
+    """
+    With RETRIEVAL_INDEX=memory, load embeddings once and follow the change feed;
+    with RETRIEVAL_INDEX=sharded, scatter-gather over the SHARD_ADDRESSES servers.
+    Returns None when searches go to Postgres.
+    """
+    global _live_index
+    if RETRIEVAL_INDEX not in ('memory', 'sharded'):
+        return None
+    if _live_index is None:
+        with _live_index_lock:
+            if _live_index is None:
+                if RETRIEVAL_INDEX == 'sharded':
+                    from sharded_retrieval import ShardedRetriever, parse_addresses
+                    _live_index = ShardedRetriever(parse_addresses(SHARD_ADDRESSES))
+                else:
+                    from embedding_feed import start_live_index
+                    _live_index, _ = start_live_index()
+    return _live_index
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -14,9 +64,74 @@ def get_moodboard():
     prompt = data.get('prompt', '')
     domain = data.get('domain')
     num_images = int(data.get('num_images', 16))
+    try:
+        required_tags = validate_tag_filter(data.get('tags'))
+        boost_tags = validate_tag_filter(data.get('boost_tags'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    images = create_moodboard(prompt, num_images, domain)
-    return jsonify({'images': images})
+    with metrics.trace('moodboard'):
+        live_index = get_live_index()
+        images = create_moodboard(
+            prompt, num_images, domain,
+            text_encoder=get_text_batcher().encode,
+            required_tags=required_tags,
+            index=live_index,
+            boost_tags=boost_tags
+        )
+        response = {'images': images}
+        # Served from the index's tag postings; the Postgres path has no tag index to ask
+        if live_index is not None:
+            with metrics.span('suggest_styles'):
+                response['suggestedStyles'] = live_index.suggest_styles(images)
+        with metrics.span('serialize'):
+            return jsonify(response)
+
+@app.route('/api/moodboard/collage', methods=['POST'])
+def get_moodboard_collage():
+    """Render (or fetch from cache) a moodboard as one composited image plus its layout map"""
+    global _collage_renderer
+    data = request.json
+    image_ids = data.get('image_ids') or []
+    if not image_ids or not isinstance(image_ids, list):
+        return jsonify({'error': 'image_ids is required'}), 400
+    rendition = data.get('rendition', 'thumbnail')
+    try:
+        columns = int(data.get('columns', 4))
+        gap = int(data.get('gap', 8))
+        # Checked up front so bad options never reach the cache or S3
+        validate_options(image_ids, rendition, columns, gap)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if _collage_renderer is None:
+        _collage_renderer = CollageRenderer()
+
+    def load_images(ids):
+        retriever = ImageRetriever(load_model=False)
+        try:
+            return retriever.get_images(ids)
+        finally:
+            retriever.close()
+
+    try:
+        with metrics.trace('collage'):
+            collage = _collage_renderer.get_or_render(
+                image_ids,
+                load_images,
+                rendition=rendition,
+                columns=columns,
+                gap=gap
+            )
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(collage)
+
+@app.route('/metrics')
+def get_metrics():
+    """Stage timing histograms (Prometheus text format, or JSON summary with ?format=json)"""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
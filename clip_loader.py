@@ -0,0 +1,34 @@
+# clip_loader.py
+import torch
+import clip
+
+QUANTIZE_MODES = ('none', 'int8')
+
+def load_clip(model_name="ViT-B/32", device=None, quantize=None, num_threads=None):
+    """
+    Load a CLIP model and its preprocess transform.
+
+    quantize='int8' applies dynamic int8 quantization to the linear layers of
+    both the text and image encoders. Quantized models only run on CPU, so the
+    device is forced to "cpu" in that mode. num_threads sets torch's intra-op
+    thread count. Returns (model, preprocess, device).
+    """
+    quantize = (quantize or 'none').lower()
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantize mode '{quantize}', expected one of {QUANTIZE_MODES}")
+    
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    
+    if quantize != 'none':
+        device = "cpu"
+    elif device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    
+    model, preprocess = clip.load(model_name, device=device, jit=False)
+    model.eval()
+    
+    if quantize == 'int8':
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    return model, preprocess, device
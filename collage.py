@@ -0,0 +1,172 @@
+# collage.py
+import io
+import json
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps
+from config import (
+    AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, S3_BUCKET_NAME, IMAGE_SIZES,
+    COLLAGE_CACHE_PREFIX, COLLAGE_MEMORY_CACHE_SIZE, COLLAGE_MAX_IMAGES, COLLAGE_MAX_GAP
+)
+from image_processor import parse_s3_url, s3_url
+
+# Tile size per source rendition; medium tiles are downscaled to keep boards light
+TILE_SIZES = {
+    'thumbnail': IMAGE_SIZES['thumbnail'],
+    'medium': (IMAGE_SIZES['medium'][0] // 2, IMAGE_SIZES['medium'][1] // 2),
+}
+
+def validate_options(image_ids, rendition, columns, gap):
+    """Reject boards that can't be laid out, or would be too costly to render, before any fetching"""
+    if rendition not in TILE_SIZES:
+        raise ValueError(f"Unsupported rendition '{rendition}'")
+    if not 1 <= len(image_ids) <= COLLAGE_MAX_IMAGES:
+        raise ValueError(f"image_ids must list between 1 and {COLLAGE_MAX_IMAGES} images")
+    for image_id in image_ids:
+        try:
+            uuid.UUID(str(image_id))
+        except ValueError:
+            raise ValueError(f"Invalid image id '{image_id}'")
+    if not 1 <= columns <= COLLAGE_MAX_IMAGES:
+        raise ValueError(f"columns must be between 1 and {COLLAGE_MAX_IMAGES}")
+    if not 0 <= gap <= COLLAGE_MAX_GAP:
+        raise ValueError(f"gap must be between 0 and {COLLAGE_MAX_GAP}")
+
+def grid_layout(image_ids, columns, tile_size, gap):
+    """Place tiles row by row; returns (canvas size, layout map)"""
+    tile_width, tile_height = tile_size
+    rows = (len(image_ids) + columns - 1) // columns
+    width = columns * tile_width + (columns + 1) * gap
+    height = rows * tile_height + (rows + 1) * gap
+    tiles = []
+    for i, image_id in enumerate(image_ids):
+        row, column = divmod(i, columns)
+        tiles.append({
+            'id': image_id,
+            'x': gap + column * (tile_width + gap),
+            'y': gap + row * (tile_height + gap),
+            'width': tile_width,
+            'height': tile_height,
+        })
+    return (width, height), tiles
+
+class CollageRenderer:
+    """
+    Renders a moodboard as one composited JPEG from its existing S3 renditions.
+    Results are stored in S3 under a content-addressed key (ordered image ids +
+    layout options), so repeat and shared views cost a single cached fetch.
+    """
+
+    def __init__(self, s3_client=None, bucket_name=S3_BUCKET_NAME, max_workers=8):
+        self.s3_client = s3_client or boto3.client(
+            's3',
+            aws_access_key_id=AWS_ACCESS_KEY,
+            aws_secret_access_key=AWS_SECRET_KEY,
+            region_name=AWS_REGION
+        )
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        # Small in-process cache of key -> result so hot boards skip the S3 lookup too
+        self.memory_cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(image_ids, rendition, columns, gap):
+        payload = json.dumps({
+            'ids': [str(image_id) for image_id in image_ids],
+            'rendition': rendition,
+            'columns': columns,
+            'gap': gap,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _remember(self, key, result):
+        with self.lock:
+            self.memory_cache[key] = result
+            self.memory_cache.move_to_end(key)
+            while len(self.memory_cache) > COLLAGE_MEMORY_CACHE_SIZE:
+                self.memory_cache.popitem(last=False)
+
+    def get_cached(self, key):
+        """Look the collage up in memory, then in S3. Returns None on a miss."""
+        with self.lock:
+            if key in self.memory_cache:
+                self.memory_cache.move_to_end(key)
+                return {**self.memory_cache[key], 'cached': True}
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=f"{COLLAGE_CACHE_PREFIX}/{key}.json")
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        result = json.loads(response['Body'].read())
+        self._remember(key, result)
+        return {**result, 'cached': True}
+
+    def _fetch_tile(self, url, tile_size):
+        bucket, key = parse_s3_url(url)
+        data = self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        return ImageOps.fit(image, tile_size, Image.LANCZOS)
+
+    def render(self, images, rendition='thumbnail', columns=4, gap=8, quality=85):
+        """
+        Compose `images` (dicts with 'id' and 'urls', in board order) into one JPEG.
+        Returns (jpeg bytes, canvas size, layout map).
+        """
+        tile_size = TILE_SIZES[rendition]
+        image_ids = [str(image['id']) for image in images]
+        (width, height), layout = grid_layout(image_ids, columns, tile_size, gap)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tiles = list(executor.map(
+                lambda image: self._fetch_tile(image['urls'][rendition], tile_size),
+                images
+            ))
+
+        canvas = Image.new('RGB', (width, height), (255, 255, 255))
+        for tile, placement in zip(tiles, layout):
+            canvas.paste(tile, (placement['x'], placement['y']))
+
+        buffer = io.BytesIO()
+        canvas.save(buffer, 'JPEG', quality=quality, optimize=True)
+        return buffer.getvalue(), (width, height), layout
+
+    def get_or_render(self, image_ids, load_images, rendition='thumbnail', columns=4, gap=8):
+        """
+        Return {'key', 'url', 'width', 'height', 'layout', 'cached'} for a board.
+        load_images(image_ids) is only called on a cache miss and must return
+        dicts with 'id' and 'urls' in the same order.
+        """
+        validate_options(image_ids, rendition, columns, gap)
+        key = self.cache_key(image_ids, rendition, columns, gap)
+        cached = self.get_cached(key)
+        if cached is not None:
+            return cached
+
+        jpeg, (width, height), layout = self.render(load_images(image_ids), rendition, columns, gap)
+        image_key = f"{COLLAGE_CACHE_PREFIX}/{key}.jpg"
+        result = {
+            'key': key,
+            'url': s3_url(self.bucket_name, image_key),
+            'width': width,
+            'height': height,
+            'layout': layout,
+        }
+        # Content-addressed, so the objects never change and can be cached forever
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=image_key, Body=jpeg,
+            ContentType='image/jpeg', CacheControl='public, max-age=31536000, immutable'
+        )
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=f"{COLLAGE_CACHE_PREFIX}/{key}.json",
+            Body=json.dumps(result).encode(), ContentType='application/json'
+        )
+        self._remember(key, result)
+        return {**result, 'cached': False}
@@ -30,4 +30,59 @@ IMAGE_SIZES = {
 
 # Rate limiting (to comply with Unsplash API limits)
 RATE_LIMIT_PER_HOUR = 50
-PHOTOS_PER_PAGE = 30
\ No newline at end of file
+PHOTOS_PER_PAGE = 30
+
+# Distributed ingestion work leasing
+INGEST_LEASE_SECONDS = int(os.getenv('INGEST_LEASE_SECONDS', '900'))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3'))
+INGEST_RETRY_BASE_SECONDS = int(os.getenv('INGEST_RETRY_BASE_SECONDS', '300'))  # doubled after each failed fetch
+INGEST_RETRY_MAX_SECONDS = int(os.getenv('INGEST_RETRY_MAX_SECONDS', '3600'))
+INGEST_MAX_PAGE = 20  # Unsplash limitation
+INGEST_ORIENTATIONS = ['', 'landscape', 'portrait', 'squarish']  # '' means any orientation
+
+# Embedding generation
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))  # images per encode_image forward pass
+EMBEDDING_LOADER_WORKERS = int(os.getenv('EMBEDDING_LOADER_WORKERS', '8'))  # threads fetching/preprocessing images
+EMBEDDING_LEASE_SECONDS = int(os.getenv('EMBEDDING_LEASE_SECONDS', '900'))  # claimed images not finished by then are reclaimed
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv('EMBEDDING_MAX_ATTEMPTS', '5'))
+EMBEDDING_RETRY_BASE_SECONDS = int(os.getenv('EMBEDDING_RETRY_BASE_SECONDS', '60'))  # doubled after each failed attempt
+EMBEDDING_RETRY_MAX_SECONDS = int(os.getenv('EMBEDDING_RETRY_MAX_SECONDS', '3600'))
+
+# CLIP model settings
+CLIP_MODEL_NAME = os.getenv('CLIP_MODEL_NAME', 'ViT-B/32')
+CLIP_QUANTIZE = os.getenv('CLIP_QUANTIZE', 'none')  # 'none' or 'int8' (dynamic int8 linear layers, CPU only)
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '0'))  # 0 leaves torch's default
+
+# Text encode micro-batching in the Flask app
+TEXT_BATCH_MAX_SIZE = int(os.getenv('TEXT_BATCH_MAX_SIZE', '32'))
+TEXT_BATCH_MAX_WAIT_MS = float(os.getenv('TEXT_BATCH_MAX_WAIT_MS', '5'))  # latency cap before a partial batch runs
+
+# Moodboard collage rendering
+COLLAGE_CACHE_PREFIX = os.getenv('COLLAGE_CACHE_PREFIX', 'collages')  # S3 prefix for rendered collages
+COLLAGE_MEMORY_CACHE_SIZE = int(os.getenv('COLLAGE_MEMORY_CACHE_SIZE', '256'))
+COLLAGE_MAX_IMAGES = int(os.getenv('COLLAGE_MAX_IMAGES', '64'))  # also caps columns
+COLLAGE_MAX_GAP = int(os.getenv('COLLAGE_MAX_GAP', '64'))  # pixels
+
+# Vector search: 'bytea' (legacy cosine_similarity scan) or 'pgvector' (vector column +
+# HNSW index; needs the vector extension, switch after migrate_embeddings.py has run)
+VECTOR_SEARCH_BACKEND = os.getenv('VECTOR_SEARCH_BACKEND', 'bytea')
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+
+# Shared database connection pool (db_pool.py)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv('DB_POOL_HEALTHCHECK_SECONDS', '30'))  # ping connections idle longer than this
+DB_CONNECT_RETRIES = int(os.getenv('DB_CONNECT_RETRIES', '3'))
+
+# Serving-side search index: 'postgres' (query the database) or 'memory'
+# (in-process InMemoryVectorIndex kept current by the embedding change feed)
+RETRIEVAL_INDEX = os.getenv('RETRIEVAL_INDEX', 'postgres')
+CHANGE_FEED_POLL_SECONDS = float(os.getenv('CHANGE_FEED_POLL_SECONDS', '5'))  # fallback when no NOTIFY arrives
+CHANGE_FEED_GAP_TIMEOUT_SECONDS = float(os.getenv('CHANGE_FEED_GAP_TIMEOUT_SECONDS', '300'))  # longest writer transaction expected
+CHANGE_FEED_RETENTION_HOURS = int(os.getenv('CHANGE_FEED_RETENTION_HOURS', '72'))
+
+# Sharded retrieval (sharded_retrieval.py), used when RETRIEVAL_INDEX=sharded
+SHARD_ADDRESSES = os.getenv('SHARD_ADDRESSES', '')  # comma-separated host:port of shard servers
+SHARD_AUTHKEY = os.getenv('SHARD_AUTHKEY')  # required: shared secret for shard connections, no default
+SHARD_TIMEOUT_MS = float(os.getenv('SHARD_TIMEOUT_MS', '250'))  # per-query deadline for shard answers
+SHARD_MIN_RESPONSES = int(os.getenv('SHARD_MIN_RESPONSES', '1'))  # fewer answers than this is an error
@@ -1,23 +1,248 @@
 # db_manager.py
-import psycopg2
 import json
-from psycopg2.extras import Json
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from contextlib import contextmanager
+import numpy as np
+from psycopg2.extras import Json, execute_values
+from tag_index import normalize_tag_tokens
+from db_pool import get_pool, execute_prepared
+from vector_store import ensure_vector_schema, to_vector_literal
+from config import VECTOR_SEARCH_BACKEND, INGEST_RETRY_BASE_SECONDS, INGEST_RETRY_MAX_SECONDS
 
-class DatabaseManager:
-    def __init__(self):
-        self.connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
+# pg_advisory_lock key that serializes schema setup across processes
+SCHEMA_LOCK_KEY = 72411
+
+@contextmanager
+def schema_lock(connection):
+    """
+    Hold a session-level advisory lock while creating or altering tables, so
+    processes that start together (e.g. embedding_backfill.py workers) run the
+    DDL one at a time instead of failing with "tuple concurrently updated".
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+    connection.commit()
+    try:
+        yield
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+        connection.commit()
+
+def create_embedding_tables(connection):
+    """
+    Create image_embeddings and the embedding_status work queue. When the
+    queue is created for the first time it is seeded from the existing images.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('embedding_status') IS NULL")
+        seed_status = cursor.fetchone()[0]
+        
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_embeddings (
+            id UUID PRIMARY KEY REFERENCES images(id),
+            embedding BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_image_embeddings_id ON image_embeddings(id);
+        
+        CREATE TABLE IF NOT EXISTS embedding_status (
+            id UUID PRIMARY KEY REFERENCES images(id),
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        -- Only pending/processing rows are indexed, so claiming cost follows the backlog, not the table
+        CREATE INDEX IF NOT EXISTS idx_embedding_status_pending
+            ON embedding_status(id) WHERE status IN ('pending', 'processing');
+        """)
+        
+        if VECTOR_SEARCH_BACKEND == 'pgvector':
+            ensure_vector_schema(cursor)
+        
+        create_embedding_change_log(cursor)
+        
+        if seed_status:
+            sync_embedding_status(cursor)
+        connection.commit()
+
+def create_embedding_change_log(cursor):
+    """Create the embedding_changes log, filled by a trigger on image_embeddings (see embedding_feed.py)"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS embedding_changes (
+        seq BIGSERIAL PRIMARY KEY,
+        id UUID NOT NULL,
+        op TEXT NOT NULL,
+        -- Wall-clock time of the write (not transaction start), so it rises with seq
+        changed_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+    );
+    CREATE INDEX IF NOT EXISTS idx_embedding_changes_changed_at ON embedding_changes(changed_at);
+    """)
+    cursor.execute("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'trg_embedding_changes' AND tgrelid = 'image_embeddings'::regclass
+    )
+    """)
+    # Only created when missing, so concurrent setups never replace a function in use
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION log_embedding_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO embedding_changes (id, op)
+        VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END, lower(TG_OP));
+        -- Identical notifications within a transaction are folded into one
+        PERFORM pg_notify('embedding_changes', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    
+    CREATE TRIGGER trg_embedding_changes
+        AFTER INSERT OR DELETE ON image_embeddings
+        FOR EACH ROW EXECUTE FUNCTION log_embedding_change();
+    """)
+
+def prune_embedding_changes(cursor, retention_hours):
+    """Drop change log rows older than the retention window; returns the number removed"""
+    cursor.execute(
+        "DELETE FROM embedding_changes WHERE changed_at < NOW() - %s * INTERVAL '1 hour'",
+        (retention_hours,)
+    )
+    return cursor.rowcount
+
+def create_catalogue_stats(connection):
+    """
+    Create catalogue_stats, the per domain/subcategory image and embedding
+    counts kept up to date by the insert paths. When the table is created for
+    the first time it is filled from the existing catalogue.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('catalogue_stats') IS NULL")
+        seed_stats = cursor.fetchone()[0]
+        
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalogue_stats (
+            domain TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            image_count BIGINT NOT NULL DEFAULT 0,
+            embedded_count BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (domain, subcategory)
+        )
+        """)
+        
+        if seed_stats:
+            reconcile_catalogue_stats(cursor)
+        connection.commit()
+
+def reconcile_catalogue_stats(cursor):
+    """Recount catalogue_stats from a full scan; returns the number of groups corrected"""
+    # Waits for in-flight inserts and holds back new ones (reads still run) so the
+    # recount sees exactly the rows whose increments have already been applied
+    cursor.execute("LOCK TABLE catalogue_stats IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute("""
+    CREATE TEMP TABLE actual_stats ON COMMIT DROP AS
+    SELECT COALESCE(i.domain, '') AS domain,
+           COALESCE(i.subcategory, '') AS subcategory,
+           COUNT(*) AS image_count,
+           COUNT(e.id) AS embedded_count
+    FROM images i
+    LEFT JOIN image_embeddings e ON e.id = i.id
+    GROUP BY 1, 2
+    """)
+    cursor.execute("""
+    INSERT INTO catalogue_stats (domain, subcategory, image_count, embedded_count)
+    SELECT domain, subcategory, image_count, embedded_count FROM actual_stats
+    ON CONFLICT (domain, subcategory) DO UPDATE
+    SET image_count = EXCLUDED.image_count,
+        embedded_count = EXCLUDED.embedded_count,
+        updated_at = NOW()
+    WHERE (catalogue_stats.image_count, catalogue_stats.embedded_count)
+        IS DISTINCT FROM (EXCLUDED.image_count, EXCLUDED.embedded_count)
+    """)
+    corrected = cursor.rowcount
+    cursor.execute("""
+    DELETE FROM catalogue_stats c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM actual_stats a WHERE a.domain = c.domain AND a.subcategory = c.subcategory
+    )
+    """)
+    return corrected + cursor.rowcount
+
+def get_catalogue_totals(cursor):
+    """(total images, images with embeddings) from catalogue_stats"""
+    cursor.execute("SELECT COALESCE(SUM(image_count), 0), COALESCE(SUM(embedded_count), 0) FROM catalogue_stats")
+    total_images, total_embeddings = cursor.fetchone()
+    return int(total_images), int(total_embeddings)
+
+def insert_embeddings(cursor, image_ids, embeddings):
+    """
+    Store embeddings as raw fp32 bytes and, with the pgvector backend, as a
+    unit-normalized vector column, and count them in catalogue_stats on the
+    same transaction. Existing rows are left untouched. Returns the number of
+    embeddings inserted.
+    """
+    embeddings = [np.asarray(embedding, dtype=np.float32).reshape(-1) for embedding in embeddings]
+    if VECTOR_SEARCH_BACKEND == 'pgvector':
+        inserted = execute_values(
+            cursor,
+            "INSERT INTO image_embeddings (id, embedding, embedding_vec) VALUES %s ON CONFLICT (id) DO NOTHING RETURNING id",
+            [(image_id, embedding.tobytes(), to_vector_literal(embedding)) for image_id, embedding in zip(image_ids, embeddings)],
+            template="(%s, %s, %s::vector)",
+            fetch=True
+        )
+    else:
+        inserted = execute_values(
+            cursor,
+            "INSERT INTO image_embeddings (id, embedding) VALUES %s ON CONFLICT (id) DO NOTHING RETURNING id",
+            [(image_id, embedding.tobytes()) for image_id, embedding in zip(image_ids, embeddings)],
+            fetch=True
         )
-        self.create_tables()
+    if not inserted:
+        return 0
+    
+    cursor.execute("""
+    SELECT COALESCE(domain, ''), COALESCE(subcategory, ''), COUNT(*)
+    FROM images
+    WHERE id = ANY(%s::uuid[])
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    """, ([str(row[0]) for row in inserted],))
+    # Rows are updated in key order so concurrent embedding batches can't deadlock
+    for domain, subcategory, count in cursor.fetchall():
+        execute_prepared(cursor, 'count_embeddings', """
+        UPDATE catalogue_stats
+        SET embedded_count = embedded_count + %s::bigint, updated_at = NOW()
+        WHERE domain = %s::text AND subcategory = %s::text
+        """, (count, domain, subcategory))
+    return len(inserted)
+
+def sync_embedding_status(cursor):
+    """Add status rows for images that don't have one yet (full scan, for one-off reconciliation)"""
+    cursor.execute("""
+    INSERT INTO embedding_status (id, status)
+    SELECT i.id, CASE WHEN e.id IS NULL THEN 'pending' ELSE 'done' END
+    FROM images i
+    LEFT JOIN image_embeddings e ON e.id = i.id
+    LEFT JOIN embedding_status s ON s.id = i.id
+    WHERE s.id IS NULL
+    """)
+    return cursor.rowcount
+
+class DatabaseManager:
+    def __init__(self, pool=None, create_tables=True):
+        # Each call borrows a connection from the shared pool (db_pool.py)
+        self.pool = pool or get_pool()
+        if create_tables:
+            self.create_tables()
         
     def create_tables(self):
         """Create necessary tables if they don't exist"""
-        with self.connection.cursor() as cursor:
+        with self.pool.connection() as connection, schema_lock(connection), connection.cursor() as cursor:
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS images (
                 id UUID PRIMARY KEY,
@@ -39,64 +264,296 @@ class DatabaseManager:
             CREATE INDEX IF NOT EXISTS idx_images_domain ON images(domain);
             CREATE INDEX IF NOT EXISTS idx_images_subcategory ON images(subcategory);
             CREATE INDEX IF NOT EXISTS idx_images_hash ON images(image_hash);
+            
+            -- One row per Unsplash query; subcategory is chosen when the item is claimed
+            CREATE TABLE IF NOT EXISTS ingest_work_items (
+                id SERIAL PRIMARY KEY,
+                domain TEXT NOT NULL,
+                search_term TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                orientation TEXT NOT NULL DEFAULT '',
+                subcategory TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires_at TIMESTAMP,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                photos_added INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (domain, search_term, page, orientation)
+            );
+            
+            CREATE INDEX IF NOT EXISTS idx_ingest_work_items_status ON ingest_work_items(status, page);
             """)
-            self.connection.commit()
+            connection.commit()
+            self._create_tag_tokens(connection)
+            create_embedding_tables(connection)
+            create_catalogue_stats(connection)
+        
+    def _create_tag_tokens(self, connection):
+        """
+        images.tag_tokens holds normalized tag tokens (tag_index.normalize_tag_tokens)
+        under a GIN index, the database-side inverted index for tag filters.
+        Existing rows are tokenized in SQL when the column is first added.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("""
+            SELECT NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'images' AND column_name = 'tag_tokens'
+            )
+            """)
+            backfill = cursor.fetchone()[0]
+            cursor.execute("""
+            ALTER TABLE images ADD COLUMN IF NOT EXISTS tag_tokens TEXT[];
+            CREATE INDEX IF NOT EXISTS idx_images_tag_tokens ON images USING GIN (tag_tokens);
+            """)
+            if backfill:
+                cursor.execute("""
+                UPDATE images i
+                SET tag_tokens = ARRAY(
+                    SELECT DISTINCT token
+                    FROM jsonb_array_elements(i.tags) AS t(tag),
+                         regexp_split_to_table(lower(COALESCE(t.tag->>'title', t.tag #>> '{}')), '[^a-z0-9]+') AS token
+                    WHERE token <> ''
+                    ORDER BY token
+                )
+                WHERE i.tags IS NOT NULL AND jsonb_typeof(i.tags) = 'array'
+                """)
+            connection.commit()
             
     def photo_exists(self, original_id):
         """Check if a photo with the given original ID exists"""
-        with self.connection.cursor() as cursor:
-            cursor.execute("SELECT EXISTS(SELECT 1 FROM images WHERE original_id = %s)", (original_id,))
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, 'photo_exists', "SELECT EXISTS(SELECT 1 FROM images WHERE original_id = %s)", (original_id,))
             return cursor.fetchone()[0]
             
     def hash_exists(self, image_hash):
         """Check if an image with the given hash exists"""
-        with self.connection.cursor() as cursor:
-            cursor.execute("SELECT EXISTS(SELECT 1 FROM images WHERE image_hash = %s)", (image_hash,))
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            execute_prepared(cursor, 'hash_exists', "SELECT EXISTS(SELECT 1 FROM images WHERE image_hash = %s)", (image_hash,))
             return cursor.fetchone()[0]
             
-    def store_image_metadata(self, metadata):
-        """Store image metadata in the database"""
-        with self.connection.cursor() as cursor:
-            cursor.execute(
-                """
-                INSERT INTO images (
-                    id, original_id, source, source_url, download_url, 
-                    dimensions, image_hash, colors, urls, attribution,
-                    domain, subcategory, tags, date_imported
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    metadata['id'],
-                    metadata['original_id'],
-                    metadata['source'],
-                    metadata['source_url'],
-                    metadata['download_url'],
-                    Json(metadata['dimensions']),
-                    metadata['hash'],
-                    Json(metadata['colors']),
-                    Json(metadata['urls']),
-                    Json(metadata['attribution']),
-                    metadata['domain'],
-                    metadata['subcategory'],
-                    Json(metadata['tags']),
-                    metadata['date_imported']
-                )
+    def store_image_metadata(self, metadata, embedding=None):
+        """Store image metadata, and its embedding if given, in one transaction"""
+        # Roll back on failure so a half-written image never leaves the connection aborted
+        with self.pool.connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    self._insert_image(cursor, metadata, embedding)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+    
+    def _insert_image(self, cursor, metadata, embedding):
+        """Write the images, image_embeddings and embedding_status rows on the caller's transaction"""
+        execute_prepared(
+            cursor,
+            'insert_image',
+            """
+            INSERT INTO images (
+                id, original_id, source, source_url, download_url, 
+                dimensions, image_hash, colors, urls, attribution,
+                domain, subcategory, tags, tag_tokens, date_imported
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                metadata['id'],
+                metadata['original_id'],
+                metadata['source'],
+                metadata['source_url'],
+                metadata['download_url'],
+                Json(metadata['dimensions']),
+                metadata['hash'],
+                Json(metadata['colors']),
+                Json(metadata['urls']),
+                Json(metadata['attribution']),
+                metadata['domain'],
+                metadata['subcategory'],
+                Json(metadata['tags']),
+                normalize_tag_tokens(metadata['tags']),
+                metadata['date_imported']
             )
-            self.connection.commit()
+        )
+        execute_prepared(
+            cursor,
+            'count_image',
+            """
+            INSERT INTO catalogue_stats (domain, subcategory, image_count)
+            VALUES (COALESCE(%s::text, ''), COALESCE(%s::text, ''), 1)
+            ON CONFLICT (domain, subcategory) DO UPDATE
+            SET image_count = catalogue_stats.image_count + 1, updated_at = NOW()
+            """,
+            (metadata['domain'], metadata['subcategory'])
+        )
+        if embedding is not None:
+            insert_embeddings(cursor, [metadata['id']], [embedding])
+        execute_prepared(
+            cursor,
+            'insert_embedding_status',
+            "INSERT INTO embedding_status (id, status) VALUES (%s, %s)",
+            (metadata['id'], 'pending' if embedding is None else 'done')
+        )
             
     def get_domain_counts(self):
-        """Get counts of images by domain and subcategory"""
-        with self.connection.cursor() as cursor:
+        """Get counts of images by domain and subcategory (from catalogue_stats)"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
             cursor.execute("""
-                SELECT domain, subcategory, COUNT(*) 
-                FROM images 
-                GROUP BY domain, subcategory
+                SELECT domain, subcategory, image_count
+                FROM catalogue_stats
+                WHERE image_count > 0
                 ORDER BY domain, subcategory
             """)
             return cursor.fetchall()
             
     def get_total_count(self):
-        """Get total count of images"""
-        with self.connection.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM images")
-            return cursor.fetchone()[0]
\ No newline at end of file
+        """Get total count of images (from catalogue_stats)"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            return get_catalogue_totals(cursor)[0]
+            
+    def reconcile_stats(self):
+        """Recount catalogue_stats from the tables; returns the number of groups corrected"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            corrected = reconcile_catalogue_stats(cursor)
+            connection.commit()
+            return corrected
+            
+    def seed_work_items(self, items):
+        """Insert (domain, search_term, page, orientation) work items, skipping existing ones"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO ingest_work_items (domain, search_term, page, orientation)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                """,
+                items,
+                page_size=1000
+            )
+            connection.commit()
+            
+    def claim_work_item(self, worker_id, subcategories, lease_seconds, max_attempts):
+        """
+        Lease the next work item for the domain of one of the given
+        (domain, subcategory) pairs. Pairs are listed by priority; the item is
+        filed under the highest-priority subcategory of its domain. Items whose
+        lease has expired are reclaimed, or marked failed once they have used
+        max_attempts. Returns a dict or None if nothing is available right now.
+        """
+        if not subcategories:
+            return None
+            
+        # Highest-priority subcategory per domain, domains in priority order
+        top_subcategory = {}
+        for domain, subcategory in subcategories:
+            top_subcategory.setdefault(domain, subcategory)
+        domains = list(top_subcategory)
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE ingest_work_items
+                SET status = 'failed', worker_id = NULL, lease_expires_at = NULL, updated_at = NOW()
+                WHERE status = 'leased' AND lease_expires_at < NOW()
+                  AND attempts >= %s
+                  AND domain = ANY(%s::text[])
+                """,
+                (max_attempts, domains)
+            )
+            cursor.execute(
+                """
+                UPDATE ingest_work_items w
+                SET status = 'leased',
+                    subcategory = (%s::text[])[array_position(%s::text[], w.domain)],
+                    worker_id = %s,
+                    lease_expires_at = NOW() + %s * INTERVAL '1 second',
+                    attempts = w.attempts + 1,
+                    updated_at = NOW()
+                WHERE w.id = (
+                    SELECT id
+                    FROM ingest_work_items
+                    WHERE ((status = 'pending' AND next_attempt_at <= NOW())
+                           OR (status = 'leased' AND lease_expires_at < NOW()))
+                      AND attempts < %s
+                      AND domain = ANY(%s::text[])
+                    ORDER BY array_position(%s::text[], domain), page, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING w.id, w.domain, w.subcategory, w.search_term, w.page, w.orientation
+                """,
+                (
+                    [top_subcategory[domain] for domain in domains], domains,
+                    worker_id, lease_seconds, max_attempts, domains, domains
+                )
+            )
+            row = cursor.fetchone()
+            connection.commit()
+            
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'domain': row[1],
+            'subcategory': row[2],
+            'search_term': row[3],
+            'page': row[4],
+            'orientation': row[5] or None
+        }
+        
+    def seconds_until_retry(self, domains, max_attempts):
+        """Seconds until the next backed-off work item in these domains is due, or None if there are none"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT GREATEST(EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()), 0)
+                FROM ingest_work_items
+                WHERE status = 'pending' AND attempts < %s AND domain = ANY(%s::text[])
+                """,
+                (max_attempts, list(domains))
+            )
+            seconds = cursor.fetchone()[0]
+            return None if seconds is None else float(seconds)
+        
+    def complete_work_item(self, item_id, worker_id, photos_added):
+        """Mark a leased work item as done. Returns False if the lease was lost."""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE ingest_work_items
+                SET status = 'done', photos_added = %s, lease_expires_at = NULL, updated_at = NOW()
+                WHERE id = %s AND worker_id = %s AND status = 'leased'
+                """,
+                (photos_added, item_id, worker_id)
+            )
+            connection.commit()
+            return cursor.rowcount == 1
+            
+    def release_work_item(self, item_id, worker_id, max_attempts):
+        """
+        Return a leased work item to the queue after a failed fetch, due again
+        after an exponential backoff, or mark it failed once attempts run out
+        """
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE ingest_work_items
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    next_attempt_at = NOW() + LEAST(%s * POWER(2, attempts - 1), %s) * INTERVAL '1 second',
+                    worker_id = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = NOW()
+                WHERE id = %s AND worker_id = %s AND status = 'leased'
+                """,
+                (max_attempts, INGEST_RETRY_BASE_SECONDS, INGEST_RETRY_MAX_SECONDS, item_id, worker_id)
+            )
+            connection.commit()
+            
+    def get_embedding_status_counts(self):
+        """Get counts of embedding_status rows by status"""
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT status, COUNT(*) FROM embedding_status GROUP BY status")
+            rows = cursor.fetchall()
+            connection.commit()
+            return dict(rows)
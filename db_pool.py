@@ -0,0 +1,192 @@
+# db_pool.py
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from vector_store import set_search_params
+
+# Settings are passed in rather than read from config.py, so the Lambda bundle
+# can use the pool without config.py or python-dotenv (get_pool reads config lazily)
+
+_PLACEHOLDER_RE = re.compile(r'%[s%]')
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+        self.last_used = time.monotonic()
+
+def to_prepared_sql(sql):
+    """Rewrite psycopg2 %s placeholders as $1..$n for PREPARE; returns (sql, parameter count)"""
+    count = 0
+    def replace(match):
+        nonlocal count
+        if match.group() == '%%':
+            return '%'
+        count += 1
+        return f"${count}"
+    return _PLACEHOLDER_RE.sub(replace, sql), count
+
+def execute_prepared(cursor, name, sql, params):
+    """
+    Run `sql` (psycopg2 %s style) as the server-side prepared statement `name`.
+    The statement is prepared on first use per connection, so later calls skip
+    parsing and planning and only send EXECUTE with the parameters. On plain
+    connections (not from a ConnectionPool) the SQL is executed directly.
+    """
+    prepared = getattr(cursor.connection, 'prepared_statements', None)
+    if prepared is None:
+        cursor.execute(sql, params)
+        return
+    if name not in prepared:
+        prepared_sql, _ = to_prepared_sql(sql)
+        cursor.execute(f"PREPARE {name} AS {prepared_sql}")
+        # Prepared statements outlive the transaction, so this holds even after a rollback
+        prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+class ConnectionPool:
+    """
+    Thread-safe pool of PooledConnections shared by everything in a process.
+    Borrowers block while all max_size connections are in use. Connections
+    idle for longer than healthcheck_seconds are pinged before reuse, and
+    broken ones are replaced, retrying the connect with backoff.
+    """
+
+    def __init__(self, min_size=1, max_size=10, healthcheck_seconds=30, connect_retries=3,
+                 configure=None, **connect_kwargs):
+        self.max_size = max_size
+        self.healthcheck_seconds = healthcheck_seconds
+        self.connect_retries = connect_retries
+        self.configure = configure
+        self.connect_kwargs = connect_kwargs
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.closed = False
+        for _ in range(min(min_size, max_size)):
+            self.idle.append(self._connect())
+
+    def _connect(self):
+        for attempt in range(self.connect_retries + 1):
+            try:
+                conn = psycopg2.connect(connection_factory=PooledConnection, **self.connect_kwargs)
+                if self.configure is not None:
+                    self.configure(conn)
+                return conn
+            except psycopg2.OperationalError as e:
+                if attempt == self.connect_retries:
+                    raise
+                delay = min(0.5 * 2 ** attempt, 10)
+                print(f"Database connection failed ({str(e).strip()}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.healthcheck_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if self.closed:
+            raise psycopg2.InterfaceError("connection pool is closed")
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    conn = self.idle.pop() if self.idle else None
+                if conn is None:
+                    return self._connect()
+                if self._healthy(conn):
+                    return conn
+                conn.close()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        try:
+            if not discard and not conn.closed:
+                # Never hand out a connection with an open or aborted transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.last_used = time.monotonic()
+                with self.lock:
+                    if not self.closed:
+                        self.idle.append(conn)
+                        return
+            conn.close()
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is rolled back and returned (or discarded if broken) afterwards"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except Exception:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+def configure_search(conn, backend, ef_search):
+    """Per-session settings for retrieval queries"""
+    if backend == 'pgvector':
+        set_search_params(conn, ef_search)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The process-wide pool configured from config.py (recreated after a fork)"""
+    global _pool, _pool_pid
+    from config import (
+        DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+        DB_POOL_HEALTHCHECK_SECONDS, DB_CONNECT_RETRIES, VECTOR_SEARCH_BACKEND, HNSW_EF_SEARCH
+    )
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                healthcheck_seconds=DB_POOL_HEALTHCHECK_SECONDS,
+                connect_retries=DB_CONNECT_RETRIES,
+                configure=lambda conn: configure_search(conn, VECTOR_SEARCH_BACKEND, HNSW_EF_SEARCH),
+                host=DB_HOST,
+                port=DB_PORT,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD
+            )
+            _pool_pid = os.getpid()
+        return _pool
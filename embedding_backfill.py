@@ -0,0 +1,165 @@
+# embedding_backfill.py
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+from tqdm import tqdm
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_LOADER_WORKERS, CLIP_QUANTIZE, TORCH_NUM_THREADS
+from clip_loader import QUANTIZE_MODES
+
+def run_shard(shard_index, num_shards, options, progress_queue):
+    """
+    Worker process: embed every pending image that hashes to this shard.
+    Sends ('progress', stats) after each batch, then ('done', None) or ('failed', error).
+    """
+    try:
+        # Imported here so each spawned process loads its own model and connections
+        from image_embeddings import EmbeddingGenerator
+
+        generator = EmbeddingGenerator(
+            quantize=options['quantize'],
+            num_threads=options['threads'],
+            shard_index=shard_index,
+            num_shards=num_shards,
+            create_tables=False
+        )
+        while True:
+            generator.process_batch(
+                batch_size=options['batch_size'],
+                encode_batch_size=options['encode_batch_size'],
+                num_workers=options['workers'],
+                verbose=False
+            )
+            if generator.last_batch_stats is None:
+                break
+            progress_queue.put((shard_index, 'progress', generator.last_batch_stats))
+    except Exception as e:
+        progress_queue.put((shard_index, 'failed', f"{type(e).__name__}: {e}"))
+    else:
+        progress_queue.put((shard_index, 'done', None))
+
+def watch_status(interval):
+    """Print queue counts and cluster-wide throughput every `interval` seconds"""
+    from db_manager import DatabaseManager
+    db_manager = DatabaseManager(create_tables=False)
+    previous_done = None
+    while True:
+        counts = db_manager.get_embedding_status_counts()
+        done = counts.get('done', 0)
+        rate = f", {(done - previous_done) / interval:.1f} images/sec" if previous_done is not None else ""
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+        print(f"[{time.strftime('%H:%M:%S')}] {summary}{rate}")
+        previous_done = done
+        if not interval:
+            return
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description='Embed pending images with several worker processes')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Worker processes on this host')
+    parser.add_argument('--total-shards', type=int, help='Shards across all hosts (defaults to --processes)')
+    parser.add_argument('--shard-offset', type=int, default=0, help='First shard index handled by this host')
+    parser.add_argument('--batch-size', type=int, default=50, help='Images claimed from the database per batch')
+    parser.add_argument('--encode-batch-size', type=int, default=EMBEDDING_BATCH_SIZE, help='Images per model forward pass')
+    parser.add_argument('--workers', type=int, default=EMBEDDING_LOADER_WORKERS, help='Loader threads per process')
+    parser.add_argument('--quantize', default=CLIP_QUANTIZE, choices=QUANTIZE_MODES, help='Inference mode for the image encoder')
+    parser.add_argument('--threads', type=int, default=TORCH_NUM_THREADS, help='Torch threads per process (0 splits the CPUs evenly)')
+    parser.add_argument('--restarts', type=int, default=2, help='Times a failed shard process is restarted before the run fails')
+    parser.add_argument('--status', type=int, nargs='?', const=0, metavar='INTERVAL',
+                        help='Only print queue counts; with INTERVAL, keep printing cluster-wide throughput')
+    args = parser.parse_args()
+
+    if args.status is not None:
+        watch_status(args.status)
+        return
+
+    total_shards = args.total_shards or args.processes
+    if args.processes < 1 or total_shards < 1:
+        parser.error("--processes and --total-shards must be at least 1")
+    if not 0 <= args.shard_offset < total_shards:
+        parser.error(f"--shard-offset must be between 0 and {total_shards - 1}")
+    shards = range(args.shard_offset, min(args.shard_offset + args.processes, total_shards))
+    options = {
+        'batch_size': args.batch_size,
+        'encode_batch_size': args.encode_batch_size,
+        'workers': args.workers,
+        'quantize': args.quantize,
+        # Avoid oversubscribing the CPU when every process runs its own model
+        'threads': args.threads or max(1, (os.cpu_count() or 1) // len(shards)),
+    }
+    print(f"Running shards {shards.start}-{shards.stop - 1} of {total_shards} "
+          f"with {options['threads']} torch threads each")
+
+    # Create the schema once here rather than in every worker at the same moment
+    from db_manager import DatabaseManager
+    DatabaseManager()
+
+    # spawn rather than fork: torch and boto3 don't survive forking a threaded parent
+    ctx = multiprocessing.get_context('spawn')
+    progress_queue = ctx.Queue()
+
+    def start_shard(shard_index):
+        process = ctx.Process(target=run_shard, args=(shard_index, total_shards, options, progress_queue))
+        process.start()
+        return process
+
+    processes = {shard_index: start_shard(shard_index) for shard_index in shards}
+    restarts = dict.fromkeys(shards, 0)
+    running = set(shards)
+    failed = {}
+
+    def shard_failed(shard_index, error):
+        processes[shard_index].join()
+        if restarts[shard_index] < args.restarts:
+            restarts[shard_index] += 1
+            print(f"Shard {shard_index} failed ({error}), restarting ({restarts[shard_index]}/{args.restarts})")
+            processes[shard_index] = start_shard(shard_index)
+        else:
+            print(f"Shard {shard_index} failed ({error}), giving up")
+            running.discard(shard_index)
+            failed[shard_index] = error
+
+    totals = {'images': 0, 'successful': 0, 'io_seconds': 0.0, 'inference_seconds': 0.0}
+    start = time.perf_counter()
+    with tqdm(unit='img') as pbar:
+        while running:
+            try:
+                shard_index, kind, payload = progress_queue.get(timeout=5)
+            except queue.Empty:
+                # A worker that crashed outright (killed, out of memory) never reports back
+                for shard_index in list(running):
+                    process = processes[shard_index]
+                    if not process.is_alive() and process.exitcode != 0:
+                        shard_failed(shard_index, f"exit code {process.exitcode}")
+                continue
+            if kind == 'done':
+                running.discard(shard_index)
+                continue
+            if kind == 'failed':
+                shard_failed(shard_index, payload)
+                continue
+            for key in totals:
+                totals[key] += payload[key]
+            pbar.update(payload['successful'])
+            elapsed = time.perf_counter() - start
+            pbar.set_postfix(
+                rate=f"{totals['successful'] / elapsed:.1f}/s",
+                failed=totals['images'] - totals['successful'],
+                running=len(running)
+            )
+
+    for process in processes.values():
+        process.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {totals['successful']}/{totals['images']} claimed images in {elapsed:.1f}s "
+          f"({totals['successful'] / elapsed:.1f} images/sec across {len(processes)} processes)")
+    print(f"Summed over processes: {totals['io_seconds']:.1f}s loading, {totals['inference_seconds']:.1f}s inference")
+    if failed:
+        print(f"Shards {sorted(failed)} of {total_shards} did not finish; their pending images were not embedded")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
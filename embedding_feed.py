@@ -0,0 +1,246 @@
+# embedding_feed.py
+import json
+import time
+import select
+import argparse
+import threading
+import numpy as np
+import psycopg2
+from config import (
+    DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, CHANGE_FEED_POLL_SECONDS,
+    CHANGE_FEED_GAP_TIMEOUT_SECONDS, CHANGE_FEED_RETENTION_HOURS
+)
+from vector_index import InMemoryVectorIndex
+from vector_store import EMBEDDING_DIM
+
+CHANNEL = 'embedding_changes'
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+def parse_json_field(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+def row_to_entry(row):
+    """(id, vector, metadata) from an image_embeddings JOIN images row"""
+    image_id, embedding, domain, subcategory, urls, colors, tags = row
+    metadata = {
+        'domain': domain,
+        'subcategory': subcategory,
+        'urls': parse_json_field(urls),
+        'colors': parse_json_field(colors),
+        'tags': parse_json_field(tags),
+    }
+    return str(image_id), np.frombuffer(bytes(embedding), dtype=np.float32), metadata
+
+ENTRY_QUERY = """
+SELECT e.id, e.embedding, i.domain, i.subcategory, i.urls, i.colors, i.tags
+FROM image_embeddings e
+JOIN images i ON i.id = e.id
+WHERE (%s = 1 OR (hashtext(e.id::text) & 2147483647) %% %s = %s)
+"""
+
+class EmbeddingChangeFeed:
+    """Keeps an InMemoryVectorIndex (or one shard of it) in step with image_embeddings via the embedding_changes log"""
+
+    def __init__(self, index, connect=connect, poll_interval=CHANGE_FEED_POLL_SECONDS,
+                 gap_timeout=CHANGE_FEED_GAP_TIMEOUT_SECONDS, retention_hours=CHANGE_FEED_RETENTION_HOURS,
+                 shard_index=0, num_shards=1):
+        self.index = index
+        self.shard_params = (num_shards, num_shards, shard_index)
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        self.retention_seconds = retention_hours * 3600
+        self.conn = None
+        self.last_seq = 0
+        self.gaps = {}
+        self.last_poll_at = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def _listen(self):
+        self.conn = self.connect()
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+    def _close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+
+    def load(self, chunk_size=10000):
+        """
+        Bulk-load every embedding into the index (dropping ids that are gone)
+        and position the high-water mark so the next poll replays the last
+        gap_timeout of changes, covering writes still in flight during the load.
+        """
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM embedding_changes WHERE changed_at <= clock_timestamp() - %s * INTERVAL '1 second'",
+                    (self.gap_timeout,)
+                )
+                start_seq = cursor.fetchone()[0]
+            conn.commit()
+
+            seen = set()
+            start = time.time()
+            with conn.cursor(name='embedding_feed_load') as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(ENTRY_QUERY, self.shard_params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    entries = [row_to_entry(row) for row in rows]
+                    self.index.add(
+                        [image_id for image_id, _, _ in entries],
+                        np.stack([vector for _, vector, _ in entries]),
+                        [metadata for _, _, metadata in entries]
+                    )
+                    seen.update(image_id for image_id, _, _ in entries)
+            conn.commit()
+        finally:
+            conn.close()
+
+        stale = [image_id for image_id in list(self.index.positions) if image_id not in seen]
+        self.index.remove(stale)
+        self.last_seq = start_seq
+        self.gaps = {}
+        self.last_poll_at = time.monotonic()
+        print(f"Loaded {len(seen)} embeddings into the index in {time.time() - start:.1f}s")
+        return len(seen)
+
+    def poll(self):
+        """Apply changes committed since the last poll; returns (upserted, removed)"""
+        now = time.monotonic()
+        if self.last_poll_at is None or now - self.last_poll_at > self.retention_seconds:
+            # Never loaded, or away long enough that the log may have been pruned past us
+            self.load()
+            now = time.monotonic()
+        if self.conn is None:
+            self._listen()
+
+        # NOTIFY only wakes the feed early; the seq high-water mark is what keeps it correct
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT seq, id
+            FROM embedding_changes
+            WHERE seq > %s OR seq = ANY(%s::bigint[])
+            ORDER BY seq
+            """, (self.last_seq, list(self.gaps)))
+            rows = cursor.fetchall()
+
+        # Writers take seq before committing, so commits land out of order: skipped seqs
+        # are re-checked as gaps until they appear or gap_timeout passes (rolled back)
+        changed = set()
+        for seq, image_id in rows:
+            changed.add(str(image_id))
+            if seq in self.gaps:
+                del self.gaps[seq]
+                continue
+            for missing in range(self.last_seq + 1, seq):
+                self.gaps[missing] = now
+            self.last_seq = max(self.last_seq, seq)
+        self.gaps = {seq: seen_at for seq, seen_at in self.gaps.items() if now - seen_at < self.gap_timeout}
+        self.last_poll_at = now
+        return self.apply(changed)
+
+    def apply(self, image_ids, chunk_size=1000):
+        """Bring the given ids in line with the database: upsert current rows, remove missing ones"""
+        image_ids = list(image_ids)
+        upserted = removed = 0
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = image_ids[start:start + chunk_size]
+            with self.conn.cursor() as cursor:
+                cursor.execute(ENTRY_QUERY + " AND e.id = ANY(%s::uuid[])", self.shard_params + (chunk,))
+                entries = [row_to_entry(row) for row in cursor.fetchall()]
+            if entries:
+                self.index.add(
+                    [image_id for image_id, _, _ in entries],
+                    np.stack([vector for _, vector, _ in entries]),
+                    [metadata for _, _, metadata in entries]
+                )
+                upserted += len(entries)
+            found = {image_id for image_id, _, _ in entries}
+            removed += self.index.remove([image_id for image_id in chunk if image_id not in found])
+        return upserted, removed
+
+    def _wait(self):
+        """Block until a NOTIFY arrives or poll_interval passes"""
+        # Notifications that arrived during poll()'s queries are already buffered
+        if self.conn.notifies:
+            self.conn.notifies.clear()
+            return
+        if select.select([self.conn], [], [], self.poll_interval)[0]:
+            self.conn.poll()
+            self.conn.notifies.clear()
+
+    def run(self):
+        retry_delay = 1
+        while not self.stop_event.is_set():
+            try:
+                upserted, removed = self.poll()
+                if upserted or removed:
+                    print(f"Change feed: {upserted} upserted, {removed} removed (index size {len(self.index)})")
+                retry_delay = 1
+                self._wait()
+            except psycopg2.Error as e:
+                print(f"Change feed error ({str(e).strip()}), reconnecting in {retry_delay}s")
+                self._close()
+                self.stop_event.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+        self._close()
+
+    def start(self):
+        """Follow the feed on a daemon thread"""
+        self.thread = threading.Thread(target=self.run, name='embedding-change-feed', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.poll_interval + 1)
+
+def start_live_index(dim=EMBEDDING_DIM, shard_index=0, num_shards=1):
+    """Load an InMemoryVectorIndex and keep it current in the background; returns (index, feed)"""
+    index = InMemoryVectorIndex(dim)
+    feed = EmbeddingChangeFeed(index, shard_index=shard_index, num_shards=num_shards)
+    feed.load()
+    return index, feed.start()
+
+def main():
+    parser = argparse.ArgumentParser(description='Follow or maintain the image embedding change feed')
+    parser.add_argument('--follow', action='store_true', help='Load the index and print changes as they are applied')
+    parser.add_argument('--prune', action='store_true', help='Delete change log rows older than the retention window')
+    parser.add_argument('--retention-hours', type=int, default=CHANGE_FEED_RETENTION_HOURS, help='Retention window for --prune')
+    args = parser.parse_args()
+
+    if args.prune:
+        from db_manager import prune_embedding_changes
+        conn = connect()
+        try:
+            with conn.cursor() as cursor:
+                removed = prune_embedding_changes(cursor, args.retention_hours)
+            conn.commit()
+        finally:
+            conn.close()
+        print(f"Pruned {removed} change log rows older than {args.retention_hours}h")
+
+    if args.follow:
+        _, feed = start_live_index()
+        try:
+            while feed.thread.is_alive():
+                feed.thread.join(1)
+        except KeyboardInterrupt:
+            feed.stop()
+
+if __name__ == "__main__":
+    main()
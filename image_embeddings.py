@@ -1,138 +1,316 @@
 # image_embeddings.py
 import os
+import time
 import torch
-import clip
 from PIL import Image
-import psycopg2
 import numpy as np
 import json
 from tqdm import tqdm
 from dotenv import load_dotenv
 import io
 import requests
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    EMBEDDING_BATCH_SIZE, EMBEDDING_LOADER_WORKERS,
+    EMBEDDING_LEASE_SECONDS, EMBEDDING_MAX_ATTEMPTS, EMBEDDING_RETRY_BASE_SECONDS, EMBEDDING_RETRY_MAX_SECONDS,
+    CLIP_MODEL_NAME, CLIP_QUANTIZE, TORCH_NUM_THREADS
+)
+from clip_loader import load_clip, QUANTIZE_MODES
+from db_pool import get_pool, execute_prepared
+from db_manager import (
+    schema_lock, create_embedding_tables, create_catalogue_stats, sync_embedding_status, insert_embeddings,
+    get_catalogue_totals
+)
+from image_processor import parse_s3_url
 import boto3
+from botocore.config import Config as BotoConfig
 
 load_dotenv()
 
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
+
 class EmbeddingGenerator:
-    def __init__(self):
-        # Load CLIP model
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {self.device}")
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+    def __init__(self, quantize=CLIP_QUANTIZE, num_threads=TORCH_NUM_THREADS, shard_index=0, num_shards=1, create_tables=True):
+        # Only claim images whose id hashes to this shard (see embedding_backfill.py)
+        self.shard_index = shard_index
+        self.num_shards = num_shards
         
-        # Setup database connection
-        self.conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
+        # Load CLIP model
+        self.model, self.preprocess, self.device = load_clip(
+            CLIP_MODEL_NAME, quantize=quantize, num_threads=num_threads
         )
+        print(f"Using device: {self.device} (quantize: {quantize})")
+        
+        # Connections are borrowed per operation from the shared pool (db_pool.py)
+        self.pool = get_pool()
+        
+        # boto3 clients are thread-safe, so one pooled client serves all loader threads
+        self.s3 = boto3.client('s3', config=BotoConfig(max_pool_connections=max(10, EMBEDDING_LOADER_WORKERS)))
+        self.last_batch_stats = None
+        
+        # Create embeddings and status tables if they don't exist (unless the caller already has)
+        if create_tables:
+            self._create_embeddings_table()
+        self._claim_cursor = MIN_UUID
         
-        # Create embeddings table if it doesn't exist
-        self._create_embeddings_table()
+        # Loader threads and the next claim's in-flight loads persist across process_batch calls
+        self._loader = None
+        self._loader_workers = None
+        self._prefetched = None
         
     def _create_embeddings_table(self):
-        with self.conn.cursor() as cursor:
+        with self.pool.connection() as conn, schema_lock(conn):
+            create_embedding_tables(conn)
+            create_catalogue_stats(conn)
+    
+    def claim_pending_images(self, limit=100):
+        """
+        Claim up to `limit` pending images, walking the queue in id order from
+        where the previous claim stopped. Rows whose retry backoff has not
+        elapsed are skipped, and rows left in 'processing' past the lease are
+        reclaimed, or marked failed once they have used EMBEDDING_MAX_ATTEMPTS.
+        Returns (id, urls) tuples.
+        """
+        for _ in range(2):
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                execute_prepared(cursor, 'claim_pending_embeddings', """
+                WITH expired AS (
+                    UPDATE embedding_status s
+                    SET status = 'failed', last_error = 'lease expired', updated_at = NOW()
+                    WHERE s.status = 'processing'
+                      AND (%s::integer = 1 OR (hashtext(s.id::text) & 2147483647) %% %s::integer = %s::integer)
+                      AND s.attempts >= %s::integer
+                      AND s.updated_at < NOW() - %s::integer * INTERVAL '1 second'
+                ),
+                claimable AS (
+                    SELECT s.id
+                    FROM embedding_status s
+                    WHERE s.status IN ('pending', 'processing')
+                      AND (%s::integer = 1 OR (hashtext(s.id::text) & 2147483647) %% %s::integer = %s::integer)
+                      AND s.id > %s::uuid
+                      AND ((s.status = 'pending' AND s.next_attempt_at <= NOW())
+                           OR (s.status = 'processing' AND s.updated_at < NOW() - %s::integer * INTERVAL '1 second'
+                               AND s.attempts < %s::integer))
+                    ORDER BY s.id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE embedding_status s
+                SET status = 'processing', attempts = s.attempts + 1, updated_at = NOW()
+                FROM claimable c, images i
+                WHERE s.id = c.id AND i.id = s.id
+                RETURNING s.id, i.urls
+                """, (
+                    self.num_shards, self.num_shards, self.shard_index,
+                    EMBEDDING_MAX_ATTEMPTS, EMBEDDING_LEASE_SECONDS,
+                    self.num_shards, self.num_shards, self.shard_index,
+                    self._claim_cursor, EMBEDDING_LEASE_SECONDS, EMBEDDING_MAX_ATTEMPTS, limit
+                ))
+                rows = sorted(cursor.fetchall(), key=lambda row: str(row[0]))
+                conn.commit()
+            
+            if rows:
+                self._claim_cursor = str(rows[-1][0])
+                return rows
+            
+            # Reached the end of the queue; wrap around once to pick up retries
+            if self._claim_cursor == MIN_UUID:
+                break
+            self._claim_cursor = MIN_UUID
+        return []
+    
+    def _mark_failed(self, image_ids, error):
+        """Record a failed attempt; back off exponentially and give up after EMBEDDING_MAX_ATTEMPTS"""
+        with self.pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute("""
-            CREATE TABLE IF NOT EXISTS image_embeddings (
-                id UUID PRIMARY KEY REFERENCES images(id),
-                embedding BYTEA NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            CREATE INDEX IF NOT EXISTS idx_image_embeddings_id ON image_embeddings(id);
-            """)
-            self.conn.commit()
-    
-    def get_unprocessed_images(self, limit=100):
-        """Get images that don't have embeddings yet"""
-        with self.conn.cursor() as cursor:
+            UPDATE embedding_status
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                last_error = %s,
+                next_attempt_at = NOW() + LEAST(%s * POWER(2, attempts - 1), %s) * INTERVAL '1 second',
+                updated_at = NOW()
+            WHERE id = ANY(%s::uuid[])
+            """, (
+                EMBEDDING_MAX_ATTEMPTS,
+                str(error)[:1000],
+                EMBEDDING_RETRY_BASE_SECONDS,
+                EMBEDDING_RETRY_MAX_SECONDS,
+                [str(image_id) for image_id in image_ids]
+            ))
+            conn.commit()
+    
+    def _load_image(self, image_id, image_urls):
+        """Download and preprocess one image. Runs in a loader thread."""
+        start = time.perf_counter()
+        
+        # Check if image_urls is already a dict or needs to be parsed
+        if isinstance(image_urls, str):
+            urls = json.loads(image_urls)
+        else:
+            urls = image_urls
+            
+        bucket, key = parse_s3_url(urls['medium'])
+        
+        # Download image directly from S3
+        response = self.s3.get_object(Bucket=bucket, Key=key)
+        img_data = response['Body'].read()
+        img = Image.open(io.BytesIO(img_data))
+        
+        # Convert to RGB if needed (for PNG with alpha channel)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+            
+        return self.preprocess(img), time.perf_counter() - start
+    
+    def _load_or_error(self, image):
+        image_id, image_urls = image
+        try:
+            image_input, load_seconds = self._load_image(image_id, image_urls)
+            return image_id, image_input, load_seconds, None
+        except Exception as e:
+            return image_id, None, 0.0, e
+    
+    def encode_images(self, image_inputs):
+        """Run one encode_image forward pass over a list of preprocessed tensors"""
+        batch = torch.stack(image_inputs).to(self.device)
+        with torch.no_grad():
+            image_features = self.model.encode_image(batch)
+        return image_features.cpu().numpy().astype(np.float32)
+    
+    def embed_image(self, img):
+        """Generate an embedding for a PIL image already decoded in memory"""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return self.encode_images([self.preprocess(img)])[0]
+    
+    def _store_embeddings(self, image_ids, embeddings):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            insert_embeddings(cursor, image_ids, embeddings)
             cursor.execute("""
-            SELECT i.id, i.urls 
-            FROM images i 
-            LEFT JOIN image_embeddings e ON i.id = e.id 
-            WHERE e.id IS NULL 
-            LIMIT %s
-            """, (limit,))
-            return cursor.fetchall()
+            UPDATE embedding_status
+            SET status = 'done', last_error = NULL, updated_at = NOW()
+            WHERE id = ANY(%s::uuid[])
+            """, ([str(image_id) for image_id in image_ids],))
+            conn.commit()
     
     def process_image(self, image_id, image_urls):
         """Generate embedding for a single image"""
         try:
-            # Check if image_urls is already a dict or needs to be parsed
-            if isinstance(image_urls, str):
-                urls = json.loads(image_urls)
-            else:
-                urls = image_urls
-                
-            # Get S3 client with boto3
-            s3 = boto3.client('s3')
-            
-            # Parse the S3 URL to get bucket and key
-            url = urls['medium']
-            # Extract bucket name and object key from URL
-            # Format: https://BUCKET.s3.amazonaws.com/KEY
-            s3_parts = url.replace('https://', '').split('/')
-            bucket = s3_parts[0].split('.')[0]
-            key = '/'.join(s3_parts[1:])
-            
-            print(f"Trying to get image from bucket: {bucket}, key: {key}")
-            
-            # Download image directly from S3
-            response = s3.get_object(Bucket=bucket, Key=key)
-            img_data = response['Body'].read()
-            img = Image.open(io.BytesIO(img_data))
-            
-            # Convert to RGB if needed (for PNG with alpha channel)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            # Preprocess and generate embedding
-            image_input = self.preprocess(img).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_input)
-                embedding = image_features.cpu().numpy().astype(np.float32)
-            
-            # Save embedding to database
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO image_embeddings (id, embedding) VALUES (%s, %s)",
-                    (image_id, embedding.tobytes())
-                )
-                self.conn.commit()
-                
+            image_input, _ = self._load_image(image_id, image_urls)
+            embeddings = self.encode_images([image_input])
+            self._store_embeddings([image_id], embeddings)
             return True
         except Exception as e:
             print(f"Error processing image {image_id}: {str(e)}")
+            self._mark_failed([image_id], e)
             return False
     
-    def process_batch(self, batch_size=100):
-        """Process a batch of images"""
-        images = self.get_unprocessed_images(batch_size)
+    def _encode_and_store(self, pending, stats):
+        """Encode a full batch of loaded images and store the embeddings"""
+        image_ids = [image_id for image_id, _ in pending]
+        try:
+            start = time.perf_counter()
+            embeddings = self.encode_images([image_input for _, image_input in pending])
+            stats['inference_seconds'] += time.perf_counter() - start
+            self._store_embeddings(image_ids, embeddings)
+            return len(image_ids)
+        except Exception as e:
+            print(f"Error encoding batch of {len(image_ids)} images: {str(e)}")
+            self._mark_failed(image_ids, e)
+            return 0
+    
+    def _get_loader(self, num_workers):
+        if self._loader is None or self._loader_workers != num_workers:
+            self.close_loader()
+            self._loader = ThreadPoolExecutor(max_workers=num_workers)
+            self._loader_workers = num_workers
+        return self._loader
+    
+    def close_loader(self):
+        """Stop the loader threads (images claimed ahead are reclaimed once their lease expires)"""
+        if self._loader is not None:
+            self._loader.shutdown(wait=False, cancel_futures=True)
+            self._loader = None
+        self._prefetched = None
+    
+    def _claim_and_load(self, batch_size, loader):
+        """Claim a batch and queue its downloads on the loader; returns (images, futures)"""
+        images = self.claim_pending_images(batch_size)
+        return images, [loader.submit(self._load_or_error, image) for image in images]
+    
+    def process_batch(self, batch_size=100, encode_batch_size=EMBEDDING_BATCH_SIZE, num_workers=EMBEDDING_LOADER_WORKERS, verbose=True):
+        """Process a batch of images, encoding encode_batch_size at a time"""
+        # Rounded up so every forward pass is full
+        batch_size = -(-max(batch_size, 1) // encode_batch_size) * encode_batch_size
+        loader = self._get_loader(num_workers)
+        if self._prefetched is not None:
+            images, futures = self._prefetched
+            self._prefetched = None
+        else:
+            images, futures = self._claim_and_load(batch_size, loader)
         if not images:
-            print("No unprocessed images found.")
+            if verbose:
+                print("No unprocessed images found.")
+            self.last_batch_stats = None
+            self.close_loader()
             return 0
+        # Claim and queue the next batch now so the loader stays busy across claims
+        self._prefetched = self._claim_and_load(batch_size, loader)
         
-        print(f"Processing {len(images)} images...")
+        if verbose:
+            print(f"Processing {len(images)} images...")
         successful = 0
+        stats = {'io_seconds': 0.0, 'wait_seconds': 0.0, 'inference_seconds': 0.0}
+        start = time.perf_counter()
+        pending = []
+        
+        with tqdm(total=len(images), disable=not verbose) as pbar:
+            for future in futures:
+                wait_start = time.perf_counter()
+                image_id, image_input, load_seconds, error = future.result()
+                stats['wait_seconds'] += time.perf_counter() - wait_start
+                
+                stats['io_seconds'] += load_seconds
+                pbar.update(1)
+                if error is not None:
+                    print(f"Error processing image {image_id}: {str(error)}")
+                    self._mark_failed([image_id], error)
+                    continue
+                    
+                pending.append((image_id, image_input))
+                if len(pending) >= encode_batch_size:
+                    successful += self._encode_and_store(pending, stats)
+                    pending = []
+                    
+            if pending:
+                successful += self._encode_and_store(pending, stats)
+        
+        elapsed = time.perf_counter() - start
+        self.last_batch_stats = {**stats, 'images': len(images), 'successful': successful, 'elapsed_seconds': elapsed}
         
-        for image_id, image_urls in tqdm(images):
-            if self.process_image(image_id, image_urls):
-                successful += 1
+        if not verbose:
+            return successful
         
+        # I/O rate is per-image load time spread across the loader threads
+        io_rate = len(images) / (stats['io_seconds'] / num_workers) if stats['io_seconds'] else 0
+        inference_rate = successful / stats['inference_seconds'] if stats['inference_seconds'] else 0
         print(f"Successfully generated embeddings for {successful}/{len(images)} images.")
+        print(f"Throughput: {successful / elapsed:.1f} images/sec "
+              f"(I/O {io_rate:.1f} images/sec, inference {inference_rate:.1f} images/sec, "
+              f"waited {stats['wait_seconds']:.1f}s on loader)")
         return successful
     
+    def sync_status(self):
+        """Reconcile embedding_status with images inserted outside DatabaseManager"""
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            added = sync_embedding_status(cursor)
+            conn.commit()
+            return added
+    
     def get_embedding_stats(self):
-        """Get statistics on embedding coverage"""
-        with self.conn.cursor() as cursor:
-            cursor.execute("SELECT COUNT(*) FROM images")
-            total_images = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM image_embeddings")
-            total_embeddings = cursor.fetchone()[0]
+        """Get statistics on embedding coverage (from catalogue_stats)"""
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            total_images, total_embeddings = get_catalogue_totals(cursor)
             
             return {
                 "total_images": total_images,
@@ -141,7 +319,20 @@ class EmbeddingGenerator:
             }
 
 def main():
-    generator = EmbeddingGenerator()
+    parser = argparse.ArgumentParser(description='Generate CLIP embeddings for stored images')
+    parser.add_argument('--batch-size', type=int, default=50, help='Images claimed from the database per batch (rounded up to a multiple of --encode-batch-size)')
+    parser.add_argument('--encode-batch-size', type=int, default=EMBEDDING_BATCH_SIZE, help='Images per model forward pass')
+    parser.add_argument('--workers', type=int, default=EMBEDDING_LOADER_WORKERS, help='Loader threads downloading and preprocessing images')
+    parser.add_argument('--quantize', default=CLIP_QUANTIZE, choices=QUANTIZE_MODES, help='Inference mode for the image encoder')
+    parser.add_argument('--threads', type=int, default=TORCH_NUM_THREADS, help='Torch intra-op threads (0 for default)')
+    parser.add_argument('--sync-status', action='store_true', help='Queue images that have no embedding status row (full table scan)')
+    args = parser.parse_args()
+    
+    generator = EmbeddingGenerator(quantize=args.quantize, num_threads=args.threads)
+    
+    if args.sync_status:
+        added = generator.sync_status()
+        print(f"Queued {added} images missing from embedding_status")
     
     # Print current stats
     stats = generator.get_embedding_stats()
@@ -150,8 +341,12 @@ def main():
     # Process all images in batches
     total_processed = 0
     while True:
-        processed = generator.process_batch(batch_size=50)
-        if processed == 0:
+        processed = generator.process_batch(
+            batch_size=args.batch_size,
+            encode_batch_size=args.encode_batch_size,
+            num_workers=args.workers
+        )
+        if generator.last_batch_stats is None:
             break
         total_processed += processed
     
@@ -7,21 +7,45 @@ from io import BytesIO
 import boto3
 from datetime import datetime
 import hashlib
+import time
+from contextlib import contextmanager
 from tqdm import tqdm
 from config import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, S3_BUCKET_NAME, IMAGE_SIZES
 
+def s3_url(bucket_name, key):
+    return f"https://{bucket_name}.s3.amazonaws.com/{key}"
+
+def parse_s3_url(url):
+    """Extract bucket name and object key from https://BUCKET.s3.amazonaws.com/KEY"""
+    s3_parts = url.replace('https://', '').split('/')
+    bucket = s3_parts[0].split('.')[0]
+    key = '/'.join(s3_parts[1:])
+    return bucket, key
+
 class ImageProcessor:
-    def __init__(self, db_manager):
-        self.s3_client = boto3.client(
+    def __init__(self, db_manager, embedder=None, s3_client=None, bucket_name=S3_BUCKET_NAME):
+        self.s3_client = s3_client or boto3.client(
             's3',
             aws_access_key_id=AWS_ACCESS_KEY,
             aws_secret_access_key=AWS_SECRET_KEY,
             region_name=AWS_REGION
         )
-        self.bucket_name = S3_BUCKET_NAME
+        self.bucket_name = bucket_name
         self.db_manager = db_manager
+        # Optional EmbeddingGenerator; when set, embeddings are computed at ingest time
+        self.embedder = embedder
         self.temp_dir = 'temp_images'
         os.makedirs(self.temp_dir, exist_ok=True)
+        # Cumulative seconds spent in each processing stage
+        self.stage_seconds = {}
+        
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
         
     def _download_image(self, url):
         """Download image from URL"""
@@ -76,7 +100,8 @@ class ImageProcessor:
         2. Create different sizes
         3. Extract metadata (colors, dimensions)
         4. Upload to S3
-        5. Store metadata in database
+        5. Optionally embed the medium rendition while it is in memory
+        6. Store metadata (and embedding) in database
         """
         try:
             photo_id = photo_data['id']
@@ -87,47 +112,61 @@ class ImageProcessor:
                 return None
                 
             # Download the image
-            image_data = self._download_image(photo_url)
+            with self._stage('download'):
+                image_data = self._download_image(photo_url)
             if not image_data:
                 return None
                 
             # Check for duplicates using image hash
-            image_hash = self._compute_image_hash(image_data)
+            with self._stage('hash'):
+                image_hash = self._compute_image_hash(image_data)
             if self.db_manager.hash_exists(image_hash):
                 return None
                 
             # Open the image with PIL
-            image = Image.open(image_data)
+            with self._stage('decode'):
+                image = Image.open(image_data)
+                image.load()
             
             # Extract image metadata
             width, height = image.size
             aspect_ratio = width / height
-            colors = self._extract_colors(image)
+            with self._stage('colors'):
+                colors = self._extract_colors(image)
             
             # Create a unique filename
             unique_id = str(uuid.uuid4())
             
             # Create different sizes and upload to S3
             s3_urls = {}
+            embedding = None
             
             for size_name, dimensions in IMAGE_SIZES.items():
-                resized = self._resize_image(image, dimensions)
+                with self._stage('resize_encode'):
+                    resized = self._resize_image(image, dimensions)
+                
+                # Embed the same rendition the backfill would download from S3
+                if self.embedder and size_name == 'medium':
+                    with self._stage('embed'):
+                        embedding = self.embedder.embed_image(resized)
                 
                 # Save to temporary file
                 temp_file = os.path.join(self.temp_dir, f"{unique_id}_{size_name}.jpg")
-                resized.save(temp_file, "JPEG", quality=85)
+                with self._stage('resize_encode'):
+                    resized.save(temp_file, "JPEG", quality=85)
                 
                 # Upload to S3
                 s3_key = f"{domain}/{subcategory}/{size_name}/{unique_id}.jpg"
-                self.s3_client.upload_file(
-                    temp_file,
-                    self.bucket_name,
-                    s3_key,
-                    ExtraArgs={'ContentType': 'image/jpeg'}
-                )
+                with self._stage('upload'):
+                    self.s3_client.upload_file(
+                        temp_file,
+                        self.bucket_name,
+                        s3_key,
+                        ExtraArgs={'ContentType': 'image/jpeg'}
+                    )
                 
                 # Generate S3 URL
-                s3_urls[size_name] = f"https://{self.bucket_name}.s3.amazonaws.com/{s3_key}"
+                s3_urls[size_name] = s3_url(self.bucket_name, s3_key)
                 
                 # Remove temporary file
                 os.remove(temp_file)
@@ -159,7 +198,8 @@ class ImageProcessor:
             }
             
             # Store in database
-            self.db_manager.store_image_metadata(metadata)
+            with self._stage('db_write'):
+                self.db_manager.store_image_metadata(metadata, embedding=embedding)
             
             return metadata
             
@@ -6,39 +6,90 @@ import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
 import json
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from contextlib import contextmanager
+from config import (
+    CLIP_MODEL_NAME, CLIP_QUANTIZE, TORCH_NUM_THREADS,
+    VECTOR_SEARCH_BACKEND, HNSW_EF_SEARCH
+)
+from clip_loader import load_clip
+from metrics import metrics
+from tag_index import normalize_tag_tokens
+from vector_store import similarity_select, similarity_conditions, similarity_params, use_exact_scan, set_search_params
+from db_pool import get_pool, execute_prepared
 
 load_dotenv()
 
+def parse_json_field(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+def encode_texts(model, device, texts):
+    """Encode a batch of prompts to CLIP embeddings in one forward pass"""
+    with torch.no_grad():
+        text_encoded = model.encode_text(clip.tokenize(texts).to(device))
+        return text_encoded.cpu().numpy().astype(np.float32)
+
 class ImageRetriever:
-    def __init__(self):
-        # Load CLIP model
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+    def __init__(self, quantize=CLIP_QUANTIZE, num_threads=TORCH_NUM_THREADS, load_model=True, conn=None, text_encoder=None, index=None):
+        # Load CLIP model (callers that already have query embeddings, or that
+        # pass a shared text_encoder such as TextEncodeBatcher.encode, can skip it)
+        self.model = self.preprocess = self.device = None
+        self.text_encoder = text_encoder
+        # Optional in-process InMemoryVectorIndex (kept live by embedding_feed.py)
+        # that serves similarity searches instead of the database
+        self.index = index
+        if load_model and text_encoder is None:
+            self.model, self.preprocess, self.device = load_clip(
+                CLIP_MODEL_NAME, quantize=quantize, num_threads=num_threads
+            )
         
-        # Setup database connection
-        self.conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
+        # Queries borrow connections from the shared pool (db_pool.py) unless
+        # the caller supplies a dedicated connection
+        self.conn = conn
+        self.pool = None if conn is not None else get_pool()
+        if conn is not None and VECTOR_SEARCH_BACKEND == 'pgvector':
+            set_search_params(conn, HNSW_EF_SEARCH)
+    
+    @contextmanager
+    def _connection(self):
+        if self.conn is not None:
+            yield self.conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
     
     def encode_text(self, text):
         """Encode text prompt to CLIP embedding"""
-        with torch.no_grad():
-            text_encoded = self.model.encode_text(clip.tokenize([text]).to(self.device))
-            return text_encoded.cpu().numpy().astype(np.float32)[0]
+        with metrics.span('encode_text'):
+            if self.text_encoder is not None:
+                return self.text_encoder(text)
+            return encode_texts(self.model, self.device, [text])[0]
     
-    def find_similar_images(self, text_prompt, num_images=16, domain=None, subcategory=None):
+    def find_similar_images(self, text_prompt, num_images=16, domain=None, subcategory=None, required_tags=None, boost_tags=None):
         """Find images similar to the text prompt"""
         # Get text embedding
         text_embedding = self.encode_text(text_prompt)
+        return self.find_similar_by_embedding(text_embedding, num_images, domain, subcategory, required_tags, boost_tags)
+    
+    def find_similar_by_embedding(self, text_embedding, num_images=16, domain=None, subcategory=None, required_tags=None, boost_tags=None):
+        """
+        Find images similar to an already computed query embedding.
+        required_tags (e.g. ["minimal"]) keeps only images carrying every tag
+        token, using the GIN index on images.tag_tokens. boost_tags ranks
+        matching images higher and only applies with a live index.
+        """
+        if self.index is not None:
+            with metrics.span('index_search'):
+                return self.index.search(
+                    text_embedding, num_images, domain=domain, subcategory=subcategory,
+                    required_tags=required_tags, boost_tags=boost_tags
+                )
         
         # Prepare query conditions
-        conditions = []
-        params = [text_embedding.tobytes()]
+        tag_tokens = normalize_tag_tokens(required_tags)
+        exact = use_exact_scan(VECTOR_SEARCH_BACKEND, bool(domain or subcategory or tag_tokens))
+        conditions = similarity_conditions(VECTOR_SEARCH_BACKEND)
+        select_params, order_params = similarity_params(text_embedding, VECTOR_SEARCH_BACKEND, exact)
+        params = list(select_params)
         
         if domain:
             conditions.append("i.domain = %s")
@@ -48,12 +99,21 @@ class ImageRetriever:
             conditions.append("i.subcategory = %s")
             params.append(subcategory)
         
+        if tag_tokens:
+            conditions.append("i.tag_tokens @> %s::text[]")
+            params.append(tag_tokens)
+        
         where_clause = " AND ".join(conditions) if conditions else ""
         if where_clause:
             where_clause = "WHERE " + where_clause
         
-        # Query using embedding similarity
-        with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        # Query using embedding similarity (HNSW index scan with pgvector unless filtered)
+        similarity_expr, order_expr = similarity_select(VECTOR_SEARCH_BACKEND, exact)
+        # One prepared statement per filter combination, since each has its own SQL text
+        statement = f"similar_{VECTOR_SEARCH_BACKEND}_" + ''.join(
+            flag for flag, value in (('d', domain), ('s', subcategory), ('t', tag_tokens)) if value
+        )
+        with self._connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             query = f"""
             SELECT 
                 i.id, 
@@ -62,47 +122,64 @@ class ImageRetriever:
                 i.urls,
                 i.colors,
                 i.tags,
-                cosine_similarity(e.embedding, %s) as similarity
+                {similarity_expr}
             FROM 
                 image_embeddings e
             JOIN 
                 images i ON e.id = i.id
             {where_clause}
             ORDER BY 
-                similarity DESC
+                {order_expr}
             LIMIT %s
             """
             
-            # Add LIMIT parameter
+            # Add ORDER BY and LIMIT parameters
+            params.extend(order_params)
             params.append(num_images)
             
             # Execute query
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            with metrics.span('sql_query'):
+                execute_prepared(cursor, statement, query, params)
+                results = cursor.fetchall()
             
             # Process results
-            images = []
-            for row in results:
-                images.append({
-                    'id': row['id'],
-                    'domain': row['domain'],
-                    'subcategory': row['subcategory'],
-                    'urls': json.loads(row['urls']) if isinstance(row['urls'], str) else row['urls'],
-                    'colors': json.loads(row['colors']) if isinstance(row['colors'], str) else row['colors'],
-                    'tags': json.loads(row['tags']) if isinstance(row['tags'], str) else row['tags'],
-                    'similarity': float(row['similarity'])
-                })
+            with metrics.span('hydrate'):
+                images = []
+                for row in results:
+                    images.append({
+                        'id': row['id'],
+                        'domain': row['domain'],
+                        'subcategory': row['subcategory'],
+                        'urls': parse_json_field(row['urls']),
+                        'colors': parse_json_field(row['colors']),
+                        'tags': parse_json_field(row['tags']),
+                        'similarity': float(row['similarity'])
+                    })
                 
             return images
     
+    def get_images(self, image_ids):
+        """Fetch id and urls for the given images, preserving the requested order"""
+        with self._connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(
+                "SELECT id, urls FROM images WHERE id = ANY(%s::uuid[])",
+                ([str(image_id) for image_id in image_ids],)
+            )
+            urls = {str(row['id']): parse_json_field(row['urls']) for row in cursor.fetchall()}
+        missing = [image_id for image_id in image_ids if str(image_id) not in urls]
+        if missing:
+            raise KeyError(f"Unknown image ids: {', '.join(map(str, missing))}")
+        return [{'id': str(image_id), 'urls': urls[str(image_id)]} for image_id in image_ids]
+    
     def close(self):
-        """Close the database connection"""
+        """Close a caller-supplied connection (pooled connections are already returned)"""
         if self.conn:
             self.conn.close()
 
 # Example function to create a moodboard
-def create_moodboard(prompt, num_images=16, domain=None):
-    retriever = ImageRetriever()
+def create_moodboard(prompt, num_images=16, domain=None, text_encoder=None, required_tags=None, index=None, boost_tags=None):
+    with metrics.span('retriever_init'):
+        retriever = ImageRetriever(text_encoder=text_encoder, index=index)
     
     try:
         # Add modifiers to improve results
@@ -112,7 +189,9 @@ def create_moodboard(prompt, num_images=16, domain=None):
         images = retriever.find_similar_images(
             enhanced_prompt, 
             num_images=num_images,
-            domain=domain
+            domain=domain,
+            required_tags=required_tags,
+            boost_tags=boost_tags
         )
         
         # Print results
@@ -1,24 +1,94 @@
 #!/usr/bin/env python
 import sys
 import json
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from image_retrieval import create_moodboard
+from tag_index import validate_tag_filter
 
-def main():
-    if len(sys.argv) != 2:
-        print(json.dumps({"error": "Prompt argument is required"}))
-        sys.exit(1)
-    
-    prompt = sys.argv[1]
-    
+def run_once(prompt):
     try:
         # Get images for the moodboard
         images = create_moodboard(prompt, num_images=16)
-        
+
         # Convert to JSON and print to stdout
         print(json.dumps(images))
     except Exception as e:
         print(json.dumps({"error": str(e)}))
         sys.exit(1)
 
+def handle_request(line, text_encoder):
+    """Answer one JSON-lines request: {"id", "prompt", "domain"?, "num_images"?, "tags"?}"""
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        prompt = request.get('prompt')
+        if not prompt:
+            return {"id": request_id, "error": "Prompt is required"}
+        images = create_moodboard(
+            prompt,
+            num_images=int(request.get('num_images', 16)),
+            domain=request.get('domain'),
+            text_encoder=text_encoder,
+            required_tags=validate_tag_filter(request.get('tags'))
+        )
+        return {"id": request_id, "images": images}
+    except Exception as e:
+        return {"id": request_id, "error": str(e)}
+
+def serve(workers):
+    """
+    Long-running mode: read JSON-lines requests on stdin and write one JSON-lines
+    response per request on stdout, tagged with the request's id. CLIP and the
+    database pool are loaded once; requests run concurrently, so responses can
+    arrive out of order, and concurrent prompts share batched text encodes.
+    """
+    from clip_loader import load_clip
+    from image_retrieval import encode_texts
+    from text_batcher import TextEncodeBatcher
+    from config import CLIP_MODEL_NAME, CLIP_QUANTIZE, TORCH_NUM_THREADS, TEXT_BATCH_MAX_SIZE, TEXT_BATCH_MAX_WAIT_MS
+
+    # stdout carries only responses; progress output from the retrieval code goes to stderr
+    responses = sys.stdout
+    write_lock = threading.Lock()
+
+    def respond(future):
+        line = json.dumps(future.result(), default=str)
+        with write_lock:
+            responses.write(line + "\n")
+            responses.flush()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        model, _, device = load_clip(CLIP_MODEL_NAME, quantize=CLIP_QUANTIZE, num_threads=TORCH_NUM_THREADS)
+        batcher = TextEncodeBatcher(
+            lambda texts: encode_texts(model, device, texts),
+            max_batch_size=TEXT_BATCH_MAX_SIZE,
+            max_wait_ms=TEXT_BATCH_MAX_WAIT_MS
+        )
+        print(f"Ready: reading requests from stdin ({workers} workers)")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for line in sys.stdin:
+                if line.strip():
+                    executor.submit(handle_request, line, batcher.encode).add_done_callback(respond)
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a moodboard for a prompt, or serve JSON-lines requests')
+    parser.add_argument('prompt', nargs='?', help='Prompt for a one-shot request')
+    parser.add_argument('--serve', action='store_true', help='Answer JSON-lines requests on stdin until EOF')
+    parser.add_argument('--workers', type=int, default=8, help='Requests processed concurrently in --serve mode')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.workers)
+    elif args.prompt:
+        run_once(args.prompt)
+    else:
+        print(json.dumps({"error": "Prompt argument is required"}))
+        sys.exit(1)
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
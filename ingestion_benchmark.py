@@ -0,0 +1,280 @@
+# ingestion_benchmark.py
+import io
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import boto3
+from botocore.config import Config as BotoConfig
+from PIL import Image
+from unsplash_client import UnsplashClient
+from image_processor import ImageProcessor
+
+STAGES = ['download', 'hash', 'decode', 'colors', 'resize_encode', 'embed', 'upload', 'db_write']
+
+def generate_photos(count, width, height, seed=0):
+    """Pre-encode a few photo-like JPEGs: smooth colour fields with sensor-like noise"""
+    rng = np.random.default_rng(seed)
+    photos = []
+    for i in range(count):
+        # Alternate orientations like a real search result page
+        w, h = (width, height) if i % 3 else (height, width)
+        base = Image.fromarray(rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)).resize((w, h), Image.BICUBIC)
+        noise = rng.normal(0, 12, size=(h, w, 3))
+        pixels = np.clip(np.asarray(base, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=92)
+        photos.append(buffer.getvalue())
+    return photos
+
+class FakeUnsplashHandler(BaseHTTPRequestHandler):
+    """Serves /search/photos result pages and the generated raw images they point at"""
+    protocol_version = 'HTTP/1.1'
+    photos = []
+    per_page = 30
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/search/photos':
+            params = parse_qs(url.query)
+            query = params.get('query', [''])[0]
+            page = int(params.get('page', ['1'])[0])
+            per_page = int(params.get('per_page', [str(self.per_page)])[0])
+            host = f"http://{self.headers['Host']}"
+            results = []
+            for i in range(per_page):
+                photo_id = hashlib.md5(f"{query}:{page}:{i}".encode()).hexdigest()[:11]
+                results.append({
+                    'id': photo_id,
+                    'urls': {'raw': f"{host}/images/{photo_id}.jpg"},
+                    'links': {'html': f"{host}/photos/{photo_id}"},
+                    'user': {'name': 'Bench User', 'username': 'bench', 'links': {'html': f"{host}/@bench"}},
+                    'tags': [{'type': 'search', 'title': word} for word in query.split()],
+                })
+            self._send(json.dumps({'total': 10000, 'total_pages': 334, 'results': results}).encode(), 'application/json')
+        elif url.path.startswith('/images/'):
+            photo_id = url.path.rsplit('/', 1)[-1].split('.')[0]
+            template = self.photos[int(photo_id, 16) % len(self.photos)]
+            # Trailing bytes after the JPEG end marker make every photo hash differently
+            self._send(template + photo_id.encode(), 'image/jpeg')
+        else:
+            self.send_error(404)
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Accepts path-style PutObject requests and counts what was stored"""
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    objects = 0
+    bytes_stored = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_PUT(self):
+        body = self._read_body()
+        with self.lock:
+            FakeS3Handler.objects += 1
+            FakeS3Handler.bytes_stored += len(body)
+        self.send_response(200)
+        self.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class InMemoryDatabase:
+    """Stand-in for DatabaseManager's ingestion calls"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.photo_ids = set()
+        self.hashes = set()
+        self.rows = 0
+
+    def photo_exists(self, original_id):
+        return original_id in self.photo_ids
+
+    def hash_exists(self, image_hash):
+        return image_hash in self.hashes
+
+    def store_image_metadata(self, metadata, embedding=None):
+        # Serialise like psycopg2's Json adapter would
+        json.dumps(metadata)
+        with self.lock:
+            self.photo_ids.add(metadata['original_id'])
+            self.hashes.add(metadata['hash'])
+            self.rows += 1
+
+class ClipImageEmbedder:
+    """Just the CLIP image encoder, for ImageProcessor's embedder hook; no database or S3 clients"""
+
+    def __init__(self):
+        import torch
+        from clip_loader import load_clip
+        from config import CLIP_MODEL_NAME, CLIP_QUANTIZE, TORCH_NUM_THREADS
+        self.torch = torch
+        self.model, self.preprocess, self.device = load_clip(
+            CLIP_MODEL_NAME, quantize=CLIP_QUANTIZE, num_threads=TORCH_NUM_THREADS
+        )
+
+    def embed_image(self, img):
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        batch = self.preprocess(img).unsqueeze(0).to(self.device)
+        with self.torch.no_grad():
+            features = self.model.encode_image(batch)
+        return features.cpu().numpy().astype(np.float32)[0]
+
+def scratch_connect_kwargs(schema=None):
+    """Connection settings for the configured database; with `schema`, tables resolve there first"""
+    from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+    kwargs = dict(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+    if schema:
+        kwargs['options'] = f"-c search_path={schema},public"
+    return kwargs
+
+def reset_schema(schema, drop_only=False):
+    """Drop (and recreate) the scratch schema that holds --use-db benchmark rows"""
+    import psycopg2
+    conn = psycopg2.connect(**scratch_connect_kwargs())
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            if not drop_only:
+                cursor.execute(f"CREATE SCHEMA {schema}")
+        conn.commit()
+    finally:
+        conn.close()
+
+def start_server(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion path against local Unsplash and S3 stand-ins')
+    parser.add_argument('--images', type=int, default=100, help='Photos to ingest')
+    parser.add_argument('--image-size', default='4000x2667', help='Raw photo size served by the fake Unsplash server')
+    parser.add_argument('--templates', type=int, default=6, help='Distinct generated photos')
+    parser.add_argument('--workers', type=int, default=1, help='Photos processed concurrently')
+    parser.add_argument('--use-db', action='store_true', help='Write to a scratch schema in the configured Postgres instead of an in-memory stand-in')
+    parser.add_argument('--schema', default='ingestion_benchmark', help='Scratch schema for --use-db (dropped afterwards)')
+    parser.add_argument('--keep-schema', action='store_true', help='Leave the --use-db scratch schema in place for inspection')
+    parser.add_argument('--embed', action='store_true', help='Include embedding at ingest time')
+    parser.add_argument('--search-term', default='minimalist interior design')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.image_size.split('x'))
+    print(f"Generating {args.templates} {width}x{height} photos...")
+    FakeUnsplashHandler.photos = generate_photos(args.templates, width, height)
+    print(f"Average raw photo size: {sum(map(len, FakeUnsplashHandler.photos)) / len(FakeUnsplashHandler.photos) / 1e6:.1f} MB")
+
+    unsplash_server, unsplash_url = start_server(FakeUnsplashHandler)
+    s3_server, s3_url = start_server(FakeS3Handler)
+
+    if args.use_db:
+        # Benchmark rows (and their noise embeddings) never touch the real catalogue tables
+        from db_pool import ConnectionPool
+        from db_manager import DatabaseManager
+        reset_schema(args.schema)
+        pool = ConnectionPool(max_size=max(2, args.workers), **scratch_connect_kwargs(args.schema))
+        db_manager = DatabaseManager(pool=pool)
+    else:
+        db_manager = InMemoryDatabase()
+
+    embedder = None
+    if args.embed:
+        # Rows are written through db_manager, so only the model is loaded
+        embedder = ClipImageEmbedder()
+
+    try:
+        s3_client = boto3.client(
+            's3',
+            endpoint_url=s3_url,
+            aws_access_key_id='bench',
+            aws_secret_access_key='bench',
+            region_name='us-east-1',
+            config=BotoConfig(s3={'addressing_style': 'path'}, max_pool_connections=max(10, args.workers))
+        )
+        local = threading.local()
+        processors = []
+
+        def get_processor():
+            if not hasattr(local, 'processor'):
+                local.processor = ImageProcessor(db_manager, embedder=embedder, s3_client=s3_client, bucket_name='bench')
+                processors.append(local.processor)
+            return local.processor
+
+        # Collect search results first so the search stage is timed on its own
+        client = UnsplashClient(api_key='bench', base_url=unsplash_url, rate_limit_per_hour=10**9)
+        photos = []
+        search_start = time.perf_counter()
+        page = 1
+        while len(photos) < args.images:
+            photos.extend(client.search_photos(args.search_term, page=page).get('results', []))
+            page += 1
+        photos = photos[:args.images]
+        search_seconds = time.perf_counter() - search_start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(
+                lambda photo: get_processor().process_unsplash_photo(photo, 'Benchmark', 'Synthetic'),
+                photos
+            ))
+        elapsed = time.perf_counter() - start
+        stored = sum(1 for result in results if result)
+
+        stage_seconds = {}
+        for processor in processors:
+            for stage, seconds in processor.stage_seconds.items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        measured = sum(stage_seconds.values())
+
+        print(f"\nIngested {stored}/{len(photos)} photos in {elapsed:.2f}s "
+              f"({stored / elapsed:.2f} images/sec with {args.workers} worker(s))")
+        print(f"Search: {search_seconds:.2f}s for {page - 1} page(s)")
+        print(f"Uploaded {FakeS3Handler.objects} objects, {FakeS3Handler.bytes_stored / 1e6:.1f} MB")
+        print(f"\n{'stage':<15}{'total s':>10}{'ms/image':>11}{'share':>8}")
+        for stage in STAGES:
+            if stage not in stage_seconds:
+                continue
+            seconds = stage_seconds[stage]
+            print(f"{stage:<15}{seconds:>10.2f}{seconds / max(stored, 1) * 1000:>11.1f}{seconds / measured:>8.1%}")
+    finally:
+        unsplash_server.shutdown()
+        s3_server.shutdown()
+        if args.use_db:
+            pool.close()
+            if args.keep_schema:
+                print(f"\nBenchmark rows left in schema {args.schema}")
+            else:
+                reset_schema(args.schema, drop_only=True)
+
+if __name__ == "__main__":
+    main()
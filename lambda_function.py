@@ -7,12 +7,59 @@ import psycopg2.extras
 import numpy as np
 import os
 import boto3
+from clip_loader import load_clip
+from metrics import metrics
+from tag_index import STYLE_KEYWORDS, tag_title, normalize_tag_tokens, validate_tag_filter
+from vector_store import similarity_select, similarity_conditions, similarity_params, use_exact_scan
+from db_pool import ConnectionPool, configure_search, execute_prepared
 
-# Load model at cold start (outside handler)
-device = "cpu"  # Lambda doesn't have GPUs
-model, preprocess = clip.load("ViT-B/32", device=device)
+# 'bytea' is the legacy cosine_similarity scan; set 'pgvector' to use the HNSW
+# index on image_embeddings.embedding_vec once migrate_embeddings.py has run
+VECTOR_SEARCH_BACKEND = os.environ.get('VECTOR_SEARCH_BACKEND', 'bytea')
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '64'))
+
+# Load model at cold start (outside handler). Lambda doesn't have GPUs;
+# CLIP_QUANTIZE=int8 trades a little accuracy for faster CPU text encoding.
+model, preprocess, device = load_clip(
+    os.environ.get('CLIP_MODEL_NAME', 'ViT-B/32'),
+    device="cpu",
+    quantize=os.environ.get('CLIP_QUANTIZE'),
+    num_threads=int(os.environ.get('TORCH_NUM_THREADS', '0'))
+)
+
+# Reused across warm invocations of this container, which handles one request at a time
+connection_pool = None
+
+def get_connection_pool():
+    global connection_pool
+    if connection_pool is None:
+        connection_pool = ConnectionPool(
+            min_size=1,
+            max_size=1,
+            configure=lambda conn: configure_search(conn, VECTOR_SEARCH_BACKEND, HNSW_EF_SEARCH),
+            host=os.environ['DB_HOST'],
+            port=os.environ['DB_PORT'],
+            dbname=os.environ['DB_NAME'],
+            user=os.environ['DB_USER'],
+            password=os.environ['DB_PASSWORD']
+        )
+    return connection_pool
 
 def lambda_handler(event, context):
+    with metrics.trace('lambda_handler') as spans:
+        response = handle_request(event)
+    
+    # One structured line per sampled invocation, for CloudWatch metric filters / Insights
+    if spans is not None:
+        print(json.dumps({
+            'type': 'metrics',
+            'request_id': getattr(context, 'aws_request_id', None),
+            'status': response['statusCode'],
+            'spans_ms': {name: round(seconds * 1000, 3) for name, seconds in spans.items()}
+        }))
+    return response
+
+def handle_request(event):
     try:
         # Parse request body
         body = json.loads(event['body'])
@@ -23,64 +70,92 @@ def lambda_handler(event, context):
                 'statusCode': 400,
                 'body': json.dumps({'error': 'Prompt is required'})
             }
+        
+        try:
+            required_tags = validate_tag_filter(body.get('tags'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
             
-        # Connect to database
-        conn = psycopg2.connect(
-            host=os.environ['DB_HOST'],
-            port=os.environ['DB_PORT'],
-            dbname=os.environ['DB_NAME'],
-            user=os.environ['DB_USER'],
-            password=os.environ['DB_PASSWORD']
-        )
+        # Connect to database (only cold starts open a connection)
+        with metrics.span('db_connect'):
+            pool = get_connection_pool()
         
         # Get text embedding
-        with torch.no_grad():
+        with metrics.span('encode_text'), torch.no_grad():
             text_encoded = model.encode_text(clip.tokenize([prompt]).to(device))
             text_embedding = text_encoded.cpu().numpy().astype(np.float32)[0]
         
-        # Query similar images
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            query = """
-            SELECT 
-                i.id, 
-                i.domain, 
-                i.subcategory, 
-                i.urls,
-                i.colors,
-                i.tags,
-                cosine_similarity(e.embedding, %s) as similarity
-            FROM 
-                image_embeddings e
-            JOIN 
-                images i ON e.id = i.id
-            ORDER BY 
-                similarity DESC
-            LIMIT 16
-            """
+        with pool.connection() as conn:
+            # Query similar images
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                query = """
+                SELECT 
+                    i.id, 
+                    i.domain, 
+                    i.subcategory, 
+                    i.urls,
+                    i.colors,
+                    i.tags,
+                    {similarity_expr}
+                FROM 
+                    image_embeddings e
+                JOIN 
+                    images i ON e.id = i.id
+                {where_clause}
+                ORDER BY 
+                    {order_expr}
+                LIMIT 16
+                """
+            
+                # Optional "must have tag" prefilter served by the GIN index on tag_tokens
+                tag_tokens = normalize_tag_tokens(required_tags)
+                exact = use_exact_scan(VECTOR_SEARCH_BACKEND, bool(tag_tokens))
+                similarity_expr, order_expr = similarity_select(VECTOR_SEARCH_BACKEND, exact)
+                select_params, order_params = similarity_params(text_embedding, VECTOR_SEARCH_BACKEND, exact)
+                params = list(select_params)
+                conditions = similarity_conditions(VECTOR_SEARCH_BACKEND)
+                if tag_tokens:
+                    conditions.append("i.tag_tokens @> %s::text[]")
+                    params.append(tag_tokens)
+                where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+                params.extend(order_params)
+                statement = f"similar_{VECTOR_SEARCH_BACKEND}_{'t' if tag_tokens else ''}"
+                query = query.format(similarity_expr=similarity_expr, order_expr=order_expr, where_clause=where_clause)
             
-            cursor.execute(query, [text_embedding.tobytes()])
-            results = cursor.fetchall()
+                with metrics.span('sql_query'):
+                    execute_prepared(cursor, statement, query, params)
+                    results = cursor.fetchall()
             
-            # Process results
-            images = []
-            for row in results:
-                # Clean up the results
-                images.append({
-                    'id': row['id'],
-                    'domain': row['domain'],
-                    'subcategory': row['subcategory'],
-                    'urls': json.loads(row['urls']) if isinstance(row['urls'], str) else row['urls'],
-                    'colors': json.loads(row['colors']) if isinstance(row['colors'], str) else row['colors'],
-                    'tags': json.loads(row['tags']) if isinstance(row['tags'], str) else row['tags'],
-                    'similarity': float(row['similarity'])
-                })
+                # Process results
+                with metrics.span('hydrate'):
+                    images = []
+                    for row in results:
+                        # Clean up the results
+                        images.append({
+                            'id': row['id'],
+                            'domain': row['domain'],
+                            'subcategory': row['subcategory'],
+                            'urls': json.loads(row['urls']) if isinstance(row['urls'], str) else row['urls'],
+                            'colors': json.loads(row['colors']) if isinstance(row['colors'], str) else row['colors'],
+                            'tags': json.loads(row['tags']) if isinstance(row['tags'], str) else row['tags'],
+                            'similarity': float(row['similarity'])
+                        })
         
         # Generate color palette and suggested styles
-        colorPalette = extract_colors(images)
-        suggestedStyles = extract_styles(images)
+        with metrics.span('extract_colors'):
+            colorPalette = extract_colors(images)
+        with metrics.span('extract_styles'):
+            suggestedStyles = extract_styles(images)
         
-        # Close database connection
-        conn.close()
+        with metrics.span('serialize'):
+            response_body = json.dumps({
+                'images': images,
+                'colorPalette': colorPalette,
+                'suggestedStyles': suggestedStyles
+            })
         
         return {
             'statusCode': 200,
@@ -88,11 +163,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'  # For CORS
             },
-            'body': json.dumps({
-                'images': images,
-                'colorPalette': colorPalette,
-                'suggestedStyles': suggestedStyles
-            })
+            'body': response_body
         }
         
     except Exception as e:
@@ -118,14 +189,13 @@ def extract_colors(images):
     return sorted(color_count.keys(), key=lambda c: color_count[c], reverse=True)[:6]
 
 def extract_styles(images):
-    # Same implementation as before
+    # A plain scan: building an index for 16 results would cost more than it saves
     style_tags = set()
-    style_keywords = ['vintage', 'modern', 'minimal', 'cinematic', 'abstract']
     
     for img in images:
-        if img.get('tags'):
-            for tag in img['tags']:
-                if any(kw in tag.lower() for kw in style_keywords):
-                    style_tags.add(tag)
+        for tag in img.get('tags') or []:
+            title = tag_title(tag)
+            if any(kw in title.lower() for kw in STYLE_KEYWORDS):
+                style_tags.add(title)
     
-    return list(style_tags)[:3]
\ No newline at end of file
+    return sorted(style_tags)[:3]
\ No newline at end of file
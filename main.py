@@ -1,138 +1,257 @@
 # main.py
+import os
 import time
 import random
+import socket
 from tqdm import tqdm
 import argparse
 from unsplash_client import UnsplashClient
 from image_processor import ImageProcessor
 from db_manager import DatabaseManager
 from allocation import DOMAIN_ALLOCATION
-from config import PHOTOS_PER_PAGE
+from config import (
+    PHOTOS_PER_PAGE, INGEST_LEASE_SECONDS, INGEST_MAX_ATTEMPTS,
+    INGEST_MAX_PAGE, INGEST_ORIENTATIONS
+)
+
+def print_counts(db_manager):
+    """Display current counts by domain and subcategory"""
+    domain_counts = db_manager.get_domain_counts()
+    total = db_manager.get_total_count()
+
+    print(f"Total images: {total}")
+    print("\nBreakdown by domain and subcategory:")
+    current_domain = None
+    domain_total = 0
+
+    for domain, subcategory, count in domain_counts:
+        if domain != current_domain:
+            if current_domain:
+                print(f"  TOTAL: {domain_total}")
+            print(f"\n{domain}:")
+            current_domain = domain
+            domain_total = 0
+
+        domain_total += count
+        print(f"  {subcategory}: {count}")
+
+    if current_domain:
+        print(f"  TOTAL: {domain_total}")
+
+def get_all_subcategories():
+    """Create a flat list of all subcategories with their allocation"""
+    all_subcategories = []
+    for domain, domain_data in DOMAIN_ALLOCATION.items():
+        for subcategory, allocation in domain_data['subcategories'].items():
+            all_subcategories.append({
+                'domain': domain,
+                'subcategory': subcategory,
+                'allocation': allocation,
+                'search_terms': domain_data['search_terms']
+            })
+    return all_subcategories
+
+def get_subcategories_to_process(db_manager, all_subcategories):
+    """Return subcategories below their allocation, highest priority first, plus the total count"""
+    domain_counts = {}
+    total = 0
+    for domain, subcategory, count in db_manager.get_domain_counts():
+        if domain not in domain_counts:
+            domain_counts[domain] = {}
+        domain_counts[domain][subcategory] = count
+        total += count
+
+    # Prioritize subcategories that need more images
+    subcategories_to_process = []
+    for subcategory_data in all_subcategories:
+        domain = subcategory_data['domain']
+        subcategory = subcategory_data['subcategory']
+        allocation = subcategory_data['allocation']
+
+        current_count = domain_counts.get(domain, {}).get(subcategory, 0)
+        if current_count < allocation:
+            # Calculate priority (higher means more images needed)
+            priority = (allocation - current_count) / allocation
+            subcategories_to_process.append({
+                **subcategory_data,
+                'current_count': current_count,
+                'priority': priority
+            })
+
+    # Sort by priority (highest first)
+    subcategories_to_process.sort(key=lambda x: x['priority'], reverse=True)
+    return subcategories_to_process, total
+
+def build_work_items():
+    """
+    Enumerate every (domain, search term, page, orientation) work item. Search
+    terms belong to a domain, so each Unsplash query is queued once per domain
+    and the subcategory its photos are filed under is picked at claim time.
+    """
+    items = []
+    for domain, domain_data in DOMAIN_ALLOCATION.items():
+        for search_term in domain_data['search_terms']:
+            for page in range(1, INGEST_MAX_PAGE + 1):
+                for orientation in INGEST_ORIENTATIONS:
+                    items.append((domain, search_term, page, orientation))
+    return items
+
+def run_worker(db_manager, unsplash_client, image_processor, total_target, worker_id, lease_seconds):
+    """
+    Process leased work items until the target is reached or the queue is drained.
+    Several workers can run this concurrently against the same database.
+    """
+    all_subcategories = get_all_subcategories()
+    db_manager.seed_work_items(build_work_items())
+
+    _, processed_count = get_subcategories_to_process(db_manager, all_subcategories)
+    print(f"Worker {worker_id} starting with {processed_count} images already processed")
+    pbar = tqdm(total=total_target, initial=processed_count)
+
+    while processed_count < total_target:
+        subcategories_to_process, processed_count = get_subcategories_to_process(db_manager, all_subcategories)
+        pbar.n = processed_count
+        pbar.refresh()
+
+        if not subcategories_to_process:
+            print("All allocations fulfilled!")
+            break
+
+        item = db_manager.claim_work_item(
+            worker_id,
+            [(s['domain'], s['subcategory']) for s in subcategories_to_process],
+            lease_seconds,
+            INGEST_MAX_ATTEMPTS
+        )
+        if item is None:
+            # Failed fetches are retried after a backoff; wait for the next one instead of exiting
+            wait_seconds = db_manager.seconds_until_retry({s['domain'] for s in subcategories_to_process}, INGEST_MAX_ATTEMPTS)
+            if wait_seconds is None:
+                print("No work items left to claim")
+                break
+            print(f"[{worker_id}] No work items due, next retry in {wait_seconds:.0f}s")
+            time.sleep(min(wait_seconds, lease_seconds) + 1)
+            continue
+
+        domain = item['domain']
+        subcategory = item['subcategory']
+        print(f"\n[{worker_id}] Fetching for {domain}/{subcategory} using search term '{item['search_term']}' (page {item['page']})")
+        # The exact query for this item, so every work item maps to one fixed Unsplash page
+        photos = unsplash_client.search_photos(item['search_term'], page=item['page'], orientation=item['orientation'], vary_query=False)
+
+        if 'error' in photos:
+            db_manager.release_work_item(item['id'], worker_id, INGEST_MAX_ATTEMPTS)
+            continue
+
+        added = 0
+        for photo in photos.get('results', []):
+            if processed_count + added >= total_target:
+                break
+
+            result = image_processor.process_unsplash_photo(photo, domain, subcategory)
+            if result:
+                added += 1
+                pbar.update(1)
+
+                # Rate limiting - pause between processing
+                time.sleep(0.5)
+
+        processed_count += added
+        if not db_manager.complete_work_item(item['id'], worker_id, added):
+            print(f"Lease on work item {item['id']} expired before completion")
+
+    pbar.close()
+    print(f"Worker {worker_id} finished with {processed_count} images in the catalogue")
 
 def main():
     parser = argparse.ArgumentParser(description='Download and process images from Unsplash')
     parser.add_argument('--target', type=int, default=100000, help='Target number of images to collect')
     parser.add_argument('--check', action='store_true', help='Just check current counts')
+    parser.add_argument('--reconcile-stats', action='store_true', help='Recount the catalogue statistics from the tables (full scan)')
+    parser.add_argument('--worker', action='store_true', help='Claim work items from the shared queue (safe to run on several machines)')
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}", help='Identifier recorded on leased work items')
+    parser.add_argument('--unsplash-key', help='Unsplash access key for this worker (defaults to UNSPLASH_ACCESS_KEY)')
+    parser.add_argument('--embed', action='store_true', help='Compute CLIP embeddings during ingestion instead of in a later backfill')
+    parser.add_argument('--lease-seconds', type=int, default=INGEST_LEASE_SECONDS, help='How long a claimed work item stays leased')
     args = parser.parse_args()
-    
+
     db_manager = DatabaseManager()
-    
+
+    if args.reconcile_stats:
+        corrected = db_manager.reconcile_stats()
+        print(f"Reconciled catalogue statistics ({corrected} groups corrected)")
+        if not args.check:
+            return
+
     # If just checking counts, display and exit
     if args.check:
-        domain_counts = db_manager.get_domain_counts()
-        total = db_manager.get_total_count()
-        
-        print(f"Total images: {total}")
-        print("\nBreakdown by domain and subcategory:")
-        current_domain = None
-        domain_total = 0
-        
-        for domain, subcategory, count in domain_counts:
-            if domain != current_domain:
-                if current_domain:
-                    print(f"  TOTAL: {domain_total}")
-                print(f"\n{domain}:")
-                current_domain = domain
-                domain_total = 0
-                
-            domain_total += count
-            print(f"  {subcategory}: {count}")
-            
-        if current_domain:
-            print(f"  TOTAL: {domain_total}")
-            
+        print_counts(db_manager)
+        return
+
+    unsplash_client = UnsplashClient(api_key=args.unsplash_key)
+    embedder = None
+    if args.embed:
+        # Imported lazily so plain ingestion doesn't need torch/CLIP
+        from image_embeddings import EmbeddingGenerator
+        embedder = EmbeddingGenerator()
+    image_processor = ImageProcessor(db_manager, embedder=embedder)
+
+    if args.worker:
+        run_worker(db_manager, unsplash_client, image_processor, args.target, args.worker_id, args.lease_seconds)
         return
-    
-    unsplash_client = UnsplashClient()
-    image_processor = ImageProcessor(db_manager)
-    
+
     # Track progress
     total_target = args.target
     processed_count = db_manager.get_total_count()
-    
+
     print(f"Starting with {processed_count} images already processed")
-    
-    # Create a flat list of all subcategories with their allocation
-    all_subcategories = []
-    for domain, domain_data in DOMAIN_ALLOCATION.items():
-        for subcategory, allocation in domain_data['subcategories'].items():
-            all_subcategories.append({
-                'domain': domain,
-                'subcategory': subcategory,
-                'allocation': allocation,
-                'search_terms': domain_data['search_terms']
-            })
-    
+
+    all_subcategories = get_all_subcategories()
+
     # Main processing loop
     pbar = tqdm(total=total_target, initial=processed_count)
-    
+
     while processed_count < total_target:
-        # Get current counts
-        domain_counts = {}
-        for domain, subcategory, count in db_manager.get_domain_counts():
-            if domain not in domain_counts:
-                domain_counts[domain] = {}
-            domain_counts[domain][subcategory] = count
-        
-        # Prioritize subcategories that need more images
-        subcategories_to_process = []
-        for subcategory_data in all_subcategories:
-            domain = subcategory_data['domain']
-            subcategory = subcategory_data['subcategory']
-            allocation = subcategory_data['allocation']
-            
-            current_count = domain_counts.get(domain, {}).get(subcategory, 0)
-            if current_count < allocation:
-                # Calculate priority (higher means more images needed)
-                priority = (allocation - current_count) / allocation
-                subcategories_to_process.append({
-                    **subcategory_data,
-                    'current_count': current_count,
-                    'priority': priority
-                })
-        
-        # Sort by priority (highest first)
-        subcategories_to_process.sort(key=lambda x: x['priority'], reverse=True)
-        
+        subcategories_to_process, _ = get_subcategories_to_process(db_manager, all_subcategories)
+
         if not subcategories_to_process:
             print("All allocations fulfilled!")
             break
-            
+
         # Select a subcategory to process based on priority
         subcategory_data = subcategories_to_process[0]
         domain = subcategory_data['domain']
         subcategory = subcategory_data['subcategory']
         search_terms = subcategory_data['search_terms']
-        
+
         # Pick a random search term from the domain
         search_term = random.choice(search_terms)
-        
+
         # Determine page to fetch (random for diversity)
-        max_page = 20  # Unsplash limitation
-        page = random.randint(1, max_page)
-        
+        page = random.randint(1, INGEST_MAX_PAGE)
+
         # Randomize orientation occasionally
         orientation = random.choice([None, 'landscape', 'portrait', 'squarish']) if random.random() < 0.3 else None
-        
+
         # Fetch photos
         print(f"\nFetching for {domain}/{subcategory} using search term '{search_term}' (page {page})")
         photos = unsplash_client.search_photos(search_term, page=page, orientation=orientation)
-        
+
         # Process each photo
         for photo in photos.get('results', []):
             if processed_count >= total_target:
                 break
-                
+
             result = image_processor.process_unsplash_photo(photo, domain, subcategory)
             if result:
                 processed_count += 1
                 pbar.update(1)
-                
+
                 # Rate limiting - pause between processing
                 time.sleep(0.5)
-    
+
     pbar.close()
     print(f"Completed processing {processed_count} images")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,132 @@
+# metrics.py
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the last bucket catches everything slower
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class Histogram:
+    """Fixed-bucket latency histogram, safe to update from several threads"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                break
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket containing it"""
+        with self.lock:
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if count and seen >= target:
+                    return bound
+        return 0.0
+
+class MetricsRegistry:
+    """
+    Per-stage timing histograms. A trace() wraps one request and decides once
+    whether it is sampled; span() calls inside an unsampled trace cost one
+    thread-local lookup.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    @contextmanager
+    def trace(self, name):
+        """
+        Time a whole request as span `name`. Yields a dict that collects the
+        duration of every span recorded during the request, or None if the
+        request was not sampled.
+        """
+        if getattr(self.local, 'spans', None) is not None or random.random() >= self.sample_rate:
+            # Nested trace, or not sampled: fall through to plain span behaviour
+            with self.span(name):
+                yield getattr(self.local, 'spans', None)
+            return
+
+        self.local.spans = {}
+        spans = self.local.spans
+        try:
+            with self.span(name):
+                yield spans
+        finally:
+            self.local.spans = None
+
+    @contextmanager
+    def span(self, name):
+        spans = getattr(self.local, 'spans', None)
+        if spans is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.histogram(name).observe(seconds)
+            spans[name] = spans.get(name, 0.0) + seconds
+
+    def snapshot(self):
+        """Summary of every histogram: count, mean and approximate p50/p95/p99 in ms"""
+        summary = {}
+        for name, histogram in sorted(self.histograms.items()):
+            if not histogram.count:
+                continue
+            summary[name] = {
+                'count': histogram.count,
+                'mean_ms': round(histogram.sum / histogram.count * 1000, 3),
+                'p50_ms': histogram.quantile(0.5) * 1000,
+                'p95_ms': histogram.quantile(0.95) * 1000,
+                'p99_ms': histogram.quantile(0.99) * 1000,
+            }
+        return summary
+
+    def render_prometheus(self, metric='lumo_stage_duration_seconds'):
+        """Render histograms in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {metric} Time spent in each request stage",
+            f"# TYPE {metric} histogram",
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {total}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+# Shared registry; METRICS_SAMPLE_RATE is the fraction of requests timed (read
+# from the environment directly so the Lambda bundle doesn't need config.py)
+metrics = MetricsRegistry(sample_rate=float(os.environ.get('METRICS_SAMPLE_RATE', '1.0')))
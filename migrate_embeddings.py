@@ -0,0 +1,103 @@
+# migrate_embeddings.py
+import time
+import argparse
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from vector_store import ensure_vector_schema, create_index_sql, to_vector_literal
+
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+def count_remaining(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM image_embeddings WHERE embedding_vec IS NULL")
+        return cursor.fetchone()[0]
+
+def backfill(conn, batch_size, sleep):
+    """
+    Copy BYTEA embeddings into embedding_vec in id-ordered batches, one
+    transaction per batch, so the catalogue stays readable and writable and an
+    interrupted run resumes where it stopped.
+    """
+    remaining = count_remaining(conn)
+    print(f"{remaining} embeddings to migrate")
+    migrated = 0
+    last_id = MIN_UUID
+    start = time.time()
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT id, embedding
+            FROM image_embeddings
+            WHERE embedding_vec IS NULL AND id > %s
+            ORDER BY id
+            LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            execute_values(cursor, """
+            UPDATE image_embeddings AS e
+            SET embedding_vec = v.embedding_vec::vector
+            FROM (VALUES %s) AS v (id, embedding_vec)
+            WHERE e.id = v.id::uuid
+            """, [
+                (str(image_id), to_vector_literal(np.frombuffer(bytes(embedding), dtype=np.float32)))
+                for image_id, embedding in rows
+            ])
+        conn.commit()
+
+        last_id = rows[-1][0]
+        migrated += len(rows)
+        rate = migrated / max(time.time() - start, 1e-9)
+        print(f"Migrated {migrated}/{remaining} ({rate:.0f}/sec)")
+        if sleep:
+            time.sleep(sleep)
+    return migrated
+
+def build_index(m, ef_construction):
+    """CREATE INDEX CONCURRENTLY cannot run inside a transaction block"""
+    conn = connect()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            print(f"Building HNSW index (m={m}, ef_construction={ef_construction})...")
+            start = time.time()
+            cursor.execute(create_index_sql(concurrently=True, m=m, ef_construction=ef_construction))
+            print(f"Index built in {time.time() - start:.1f}s")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the pgvector embedding column and build its HNSW index')
+    parser.add_argument('--batch-size', type=int, default=2000, help='Rows updated per transaction')
+    parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between batches to limit load')
+    parser.add_argument('--skip-index', action='store_true', help='Only backfill, do not build the index')
+    parser.add_argument('--m', type=int, default=16, help='HNSW max connections per layer')
+    parser.add_argument('--ef-construction', type=int, default=64, help='HNSW build-time candidate list size')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            ensure_vector_schema(cursor)
+        conn.commit()
+        backfill(conn, args.batch_size, args.sleep)
+        remaining = count_remaining(conn)
+    finally:
+        conn.close()
+
+    if remaining:
+        print(f"Warning: {remaining} rows still have no vector (written without it during the backfill?). Re-run to pick them up.")
+    if not args.skip_index:
+        build_index(args.m, args.ef_construction)
+    print("Done. Set VECTOR_SEARCH_BACKEND=pgvector for writers and readers to serve queries from the index, "
+          "then re-run to fill rows written before the switch (they are skipped by searches until then).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# quantization_check.py
+import io
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import clip
+import boto3
+import psycopg2
+from PIL import Image
+from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, CLIP_MODEL_NAME, TORCH_NUM_THREADS
+from clip_loader import load_clip
+from image_processor import parse_s3_url
+
+DEFAULT_PROMPTS = [
+    "minimalist scandinavian interior",
+    "vintage street fashion",
+    "bold colorful graphic design poster",
+    "moody cinematic landscape at dusk",
+    "elegant wedding table decoration",
+    "abstract textured painting",
+    "modern concrete architecture",
+    "product shot on white background",
+]
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def top_k(query, corpus, k):
+    return set(np.argsort(-(corpus @ query))[:k])
+
+def overlap(queries_a, corpus_a, queries_b, corpus_b, k):
+    """Mean fraction of top-k results shared between two (query, corpus) embeddings"""
+    shared = [
+        len(top_k(qa, corpus_a, k) & top_k(qb, corpus_b, k)) / k
+        for qa, qb in zip(queries_a, queries_b)
+    ]
+    return float(np.mean(shared))
+
+def encode_texts(model, prompts):
+    start = time.perf_counter()
+    with torch.no_grad():
+        features = model.encode_text(clip.tokenize(prompts))
+    elapsed = time.perf_counter() - start
+    return normalize(features.float().numpy()), len(prompts) / elapsed
+
+def encode_images(model, image_inputs):
+    start = time.perf_counter()
+    with torch.no_grad():
+        features = model.encode_image(torch.stack(image_inputs))
+    elapsed = time.perf_counter() - start
+    return normalize(features.float().numpy()), len(image_inputs) / elapsed
+
+def load_corpus(limit):
+    """Load stored (fp32) image embeddings and their URLs"""
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT e.embedding, i.urls
+            FROM image_embeddings e
+            JOIN images i ON e.id = i.id
+            ORDER BY e.id
+            LIMIT %s
+            """, (limit,))
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    vectors = np.stack([np.frombuffer(bytes(row[0]), dtype=np.float32) for row in rows])
+    urls = [json.loads(row[1]) if isinstance(row[1], str) else row[1] for row in rows]
+    return normalize(vectors), urls
+
+def load_images(urls, preprocess):
+    s3 = boto3.client('s3')
+    image_inputs = []
+    for image_urls in urls:
+        bucket, key = parse_s3_url(image_urls['medium'])
+        img_data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        image_inputs.append(preprocess(Image.open(io.BytesIO(img_data)).convert("RGB")))
+    return image_inputs
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare int8-quantized CLIP inference against fp32 on CPU')
+    parser.add_argument('--corpus-size', type=int, default=5000, help='Stored embeddings to search over')
+    parser.add_argument('--image-sample', type=int, default=64, help='Images to re-embed with both encoders')
+    parser.add_argument('--k', type=int, default=16, help='Top-k used for retrieval overlap')
+    parser.add_argument('--threads', type=int, default=TORCH_NUM_THREADS, help='Torch intra-op threads (0 for default)')
+    parser.add_argument('--prompts', nargs='*', default=DEFAULT_PROMPTS, help='Text prompts to evaluate')
+    args = parser.parse_args()
+
+    fp32_model, preprocess, _ = load_clip(CLIP_MODEL_NAME, device="cpu", num_threads=args.threads)
+    int8_model, _, _ = load_clip(CLIP_MODEL_NAME, quantize='int8', num_threads=args.threads)
+
+    corpus, urls = load_corpus(args.corpus_size)
+    k = min(args.k, len(corpus))
+    print(f"Loaded {len(corpus)} stored embeddings")
+
+    # Text encoder: same stored corpus, fp32 vs int8 query embeddings
+    fp32_text, fp32_text_rate = encode_texts(fp32_model, args.prompts)
+    int8_text, int8_text_rate = encode_texts(int8_model, args.prompts)
+    text_cosine = np.sum(fp32_text * int8_text, axis=1)
+    print("\nText encoder")
+    print(f"  fp32: {fp32_text_rate:.1f} prompts/sec, int8: {int8_text_rate:.1f} prompts/sec")
+    print(f"  cosine(fp32, int8): mean {text_cosine.mean():.4f}, min {text_cosine.min():.4f}")
+    print(f"  top-{k} overlap vs fp32: {overlap(fp32_text, corpus, int8_text, corpus, k):.3f}")
+
+    # Image encoder: re-embed a sample with both models
+    sample_urls = urls[:args.image_sample]
+    if not sample_urls:
+        return
+    image_inputs = load_images(sample_urls, preprocess)
+    fp32_images, fp32_image_rate = encode_images(fp32_model, image_inputs)
+    int8_images, int8_image_rate = encode_images(int8_model, image_inputs)
+    image_cosine = np.sum(fp32_images * int8_images, axis=1)
+    sample_k = min(k, len(image_inputs))
+    print(f"\nImage encoder ({len(image_inputs)} images)")
+    print(f"  fp32: {fp32_image_rate:.1f} images/sec, int8: {int8_image_rate:.1f} images/sec")
+    print(f"  cosine(fp32, int8): mean {image_cosine.mean():.4f}, min {image_cosine.min():.4f}")
+    print(f"  top-{sample_k} overlap vs fp32 (fp32 queries): {overlap(fp32_text, fp32_images, fp32_text, int8_images, sample_k):.3f}")
+    print(f"  top-{sample_k} overlap vs fp32 (int8 end to end): {overlap(fp32_text, fp32_images, int8_text, int8_images, sample_k):.3f}")
+
+if __name__ == "__main__":
+    main()
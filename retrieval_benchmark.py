@@ -0,0 +1,309 @@
+# retrieval_benchmark.py
+import io
+import json
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from allocation import DOMAIN_ALLOCATION
+from config import IMAGE_SIZES, VECTOR_SEARCH_BACKEND
+from vector_index import InMemoryVectorIndex
+from vector_store import create_index_sql, to_vector_literal
+from tag_index import normalize_tag_tokens
+
+EMBEDDING_DIM = 512
+STYLE_WORDS = ['vintage', 'modern', 'minimal', 'cinematic', 'abstract', 'moody', 'bright', 'rustic']
+
+def generate_metadata(rng, n):
+    """Metadata shaped like rows of the images table, spread by DOMAIN_ALLOCATION"""
+    pairs, weights = [], []
+    for domain, domain_data in DOMAIN_ALLOCATION.items():
+        for subcategory, allocation in domain_data['subcategories'].items():
+            pairs.append((domain, subcategory, domain_data['search_terms']))
+            weights.append(allocation)
+    choices = rng.choice(len(pairs), size=n, p=np.array(weights) / sum(weights))
+
+    metadata = []
+    for choice in choices:
+        domain, subcategory, search_terms = pairs[choice]
+        image_id = str(uuid.UUID(bytes=rng.bytes(16), version=4))
+        prefix = f"https://bench.s3.amazonaws.com/{domain}/{subcategory}"
+        titles = list(rng.choice(search_terms, size=2, replace=False)) + list(rng.choice(STYLE_WORDS, size=1))
+        metadata.append({
+            'id': image_id,
+            'domain': domain,
+            'subcategory': subcategory,
+            'urls': {size_name: f"{prefix}/{size_name}/{image_id}.jpg" for size_name in IMAGE_SIZES},
+            'colors': [
+                {'hex': '#{:06x}'.format(int(rng.integers(0, 2**24))), 'percentage': round(float(p), 4)}
+                for p in sorted(rng.dirichlet(np.ones(6)), reverse=True)
+            ],
+            'tags': [{'type': 'search', 'title': str(title)} for title in titles],
+        })
+    return metadata
+
+def generate_embeddings(rng, n, num_clusters=256, noise=1.0, chunk_size=100000):
+    """
+    CLIP-like embeddings: unit vectors scattered around a set of topic centres,
+    so nearest neighbours are meaningful rather than uniformly random.
+    """
+    centres = rng.standard_normal((num_clusters, EMBEDDING_DIM)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    embeddings = np.empty((n, EMBEDDING_DIM), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        assignment = rng.integers(0, num_clusters, size=end - start)
+        # Noise of norm ~`noise` keeps members at cosine ~0.7 from their centre
+        chunk = centres[assignment] + noise / np.sqrt(EMBEDDING_DIM) * rng.standard_normal((end - start, EMBEDDING_DIM)).astype(np.float32)
+        embeddings[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return embeddings, centres
+
+def generate_queries(rng, centres, num_queries, noise=1.2):
+    assignment = rng.integers(0, len(centres), size=num_queries)
+    queries = centres[assignment] + noise / np.sqrt(EMBEDDING_DIM) * rng.standard_normal((num_queries, EMBEDDING_DIM)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+class MemoryBackend:
+    """In-process stand-in: exact search over an InMemoryVectorIndex"""
+    name = 'memory'
+
+    def __init__(self, embeddings, metadata):
+        self.index = InMemoryVectorIndex(EMBEDDING_DIM)
+        self.index.add([m['id'] for m in metadata], embeddings, metadata)
+
+    def search(self, query, k, domain=None, required_tags=None):
+        return self.index.search(query, k, domain=domain, required_tags=required_tags)
+
+    def close(self):
+        pass
+
+class PostgresBackend:
+    """
+    Loads the corpus into a scratch schema and runs ImageRetriever.find_similar_by_embedding,
+    the same SQL path the API uses. Each benchmark thread gets its own connection.
+    """
+    name = 'postgres'
+
+    def __init__(self, embeddings, metadata, dsn, schema):
+        import psycopg2
+        self.psycopg2 = psycopg2
+        self.dsn = dsn
+        self.schema = schema
+        self.local = threading.local()
+        self.connections = []
+
+        self.vector_backend = VECTOR_SEARCH_BACKEND
+
+        conn = self._connect(set_path=False)
+        with conn.cursor() as cursor:
+            if self.vector_backend == 'pgvector':
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            else:
+                cursor.execute("SELECT to_regprocedure('cosine_similarity(bytea,bytea)') IS NOT NULL")
+                if not cursor.fetchone()[0]:
+                    raise RuntimeError("cosine_similarity(bytea, bytea) is not defined in this database")
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+            cursor.execute(f"SET search_path TO {schema}, public")
+            cursor.execute("""
+            CREATE TABLE images (
+                id UUID PRIMARY KEY, domain TEXT, subcategory TEXT,
+                urls JSONB, colors JSONB, tags JSONB, tag_tokens TEXT[]
+            );
+            CREATE TABLE image_embeddings (
+                id UUID PRIMARY KEY REFERENCES images(id),
+                embedding BYTEA NOT NULL
+            );
+            CREATE INDEX idx_images_domain ON images(domain);
+            CREATE INDEX idx_images_tag_tokens ON images USING GIN (tag_tokens);
+            """)
+            if self.vector_backend == 'pgvector':
+                cursor.execute(f"ALTER TABLE image_embeddings ADD COLUMN embedding_vec vector({embeddings.shape[1]})")
+            self._copy(cursor, embeddings, metadata)
+            if self.vector_backend == 'pgvector':
+                # Build after the bulk load, as migrate_embeddings.py does in production
+                start = time.perf_counter()
+                cursor.execute(create_index_sql())
+                print(f"  built HNSW index in {time.perf_counter() - start:.1f}s")
+            cursor.execute("ANALYZE images; ANALYZE image_embeddings")
+        conn.commit()
+
+    def _connect(self, set_path=True):
+        conn = self.psycopg2.connect(self.dsn)
+        if set_path:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SET search_path TO {self.schema}, public")
+            conn.commit()
+        self.connections.append(conn)
+        return conn
+
+    def _copy(self, cursor, embeddings, metadata, chunk_size=10000):
+        for start in range(0, len(metadata), chunk_size):
+            images, vectors = io.StringIO(), io.StringIO()
+            for meta, embedding in zip(metadata[start:start + chunk_size], embeddings[start:start + chunk_size]):
+                images.write('\t'.join([
+                    meta['id'], meta['domain'], meta['subcategory'],
+                    *(json.dumps(meta[field]).replace('\\', '\\\\') for field in ('urls', 'colors', 'tags')),
+                    '{' + ','.join(normalize_tag_tokens(meta['tags'])) + '}'
+                ]) + '\n')
+                row = [meta['id'], f"\\\\x{embedding.tobytes().hex()}"]
+                if self.vector_backend == 'pgvector':
+                    row.append(to_vector_literal(embedding))
+                vectors.write('\t'.join(row) + '\n')
+            images.seek(0)
+            vectors.seek(0)
+            cursor.copy_from(images, 'images', columns=('id', 'domain', 'subcategory', 'urls', 'colors', 'tags', 'tag_tokens'))
+            columns = ('id', 'embedding', 'embedding_vec') if self.vector_backend == 'pgvector' else ('id', 'embedding')
+            cursor.copy_from(vectors, 'image_embeddings', columns=columns)
+
+    def _retriever(self):
+        if not hasattr(self.local, 'retriever'):
+            from image_retrieval import ImageRetriever
+            self.local.retriever = ImageRetriever(load_model=False, conn=self._connect())
+        return self.local.retriever
+
+    def search(self, query, k, domain=None, required_tags=None):
+        return self._retriever().find_similar_by_embedding(query, num_images=k, domain=domain, required_tags=required_tags)
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+class ShardedBackend:
+    """
+    Scatter-gather over local shard server processes. Each shard regenerates
+    the same synthetic corpus and keeps its slice (see sharded_retrieval.py).
+    """
+    name = 'sharded'
+
+    def __init__(self, size, seed, num_shards, timeout_ms):
+        import secrets
+        from sharded_retrieval import ShardedRetriever, start_local_shards
+        # Throwaway key for these local processes, so the benchmark doesn't need SHARD_AUTHKEY
+        authkey = secrets.token_hex(32)
+        start = time.perf_counter()
+        addresses, self.processes = start_local_shards(num_shards, authkey=authkey, synthetic=(size, seed))
+        print(f"  started {num_shards} shard processes in {time.perf_counter() - start:.1f}s")
+        self.retriever = ShardedRetriever(addresses, authkey=authkey, timeout_ms=timeout_ms)
+
+    def search(self, query, k, domain=None, required_tags=None):
+        return self.retriever.search(query, k, domain=domain, required_tags=required_tags)
+
+    def close(self):
+        self.retriever.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) * 1000 if values else 0.0
+
+def measure(backend, queries, filters, k, concurrency):
+    """Run every query once with its filters; return per-query latencies (s), wall time and results"""
+    def run(i):
+        start = time.perf_counter()
+        result = backend.search(queries[i], k, **filters[i])
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        outcomes = [run(i) for i in range(len(queries))]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(run, range(len(queries))))
+    wall = time.perf_counter() - start
+    return [latency for latency, _ in outcomes], wall, [result for _, result in outcomes]
+
+def recall(results, ground_truth, k):
+    hits = [
+        len({image['id'] for image in result} & set(truth)) / max(1, min(k, len(truth)))
+        for result, truth in zip(results, ground_truth)
+    ]
+    return float(np.mean(hits)) if hits else float('nan')
+
+def run_benchmark(size, backends, args):
+    rng = np.random.default_rng(args.seed + size)
+    print(f"\nGenerating corpus of {size} embeddings...")
+    embeddings, centres = generate_embeddings(rng, size)
+    metadata = generate_metadata(rng, size)
+    queries = generate_queries(rng, centres, args.queries)
+    domain_names = list(DOMAIN_ALLOCATION)
+    filters = []
+    for _ in range(args.queries):
+        draw = rng.random()
+        if draw < args.filter_ratio:
+            filters.append({'domain': domain_names[int(rng.integers(0, len(domain_names)))]})
+        elif draw < args.filter_ratio + args.tag_ratio:
+            filters.append({'required_tags': [STYLE_WORDS[int(rng.integers(0, len(STYLE_WORDS)))]]})
+        else:
+            filters.append({})
+    filtered = [i for i, f in enumerate(filters) if f]
+
+    # Ground truth from exact search
+    exact = MemoryBackend(embeddings, metadata)
+    ground_truth = [[image['id'] for image in exact.search(q, args.k, **f)] for q, f in zip(queries, filters)]
+
+    rows = []
+    for backend_name in backends:
+        if backend_name == 'memory':
+            backend = exact
+        elif backend_name == 'sharded':
+            backend = ShardedBackend(size, args.seed, args.shards, args.shard_timeout_ms)
+        else:
+            backend = PostgresBackend(embeddings, metadata, args.dsn, f"bench_{size}")
+        try:
+            # Warm-up pass so caches and connections are in place
+            measure(backend, queries[:min(10, len(queries))], filters, args.k, 1)
+            for concurrency in args.concurrency:
+                latencies, wall, results = measure(backend, queries, filters, args.k, concurrency)
+                rows.append({
+                    'corpus_size': size,
+                    'backend': backend_name,
+                    'concurrency': concurrency,
+                    'p50_ms': percentile(latencies, 50),
+                    'p95_ms': percentile(latencies, 95),
+                    'p99_ms': percentile(latencies, 99),
+                    'qps': len(queries) / wall,
+                    'recall': recall(results, ground_truth, args.k),
+                    # Filtered queries on their own: an index that filters after the scan shows up here
+                    'recall_filtered': recall([results[i] for i in filtered], [ground_truth[i] for i in filtered], args.k),
+                })
+                print(f"  {backend_name:<9} c={concurrency:<3} p50 {rows[-1]['p50_ms']:8.2f}ms  "
+                      f"p95 {rows[-1]['p95_ms']:8.2f}ms  p99 {rows[-1]['p99_ms']:8.2f}ms  "
+                      f"{rows[-1]['qps']:9.1f} qps  recall@{args.k} {rows[-1]['recall']:.3f} (filtered {rows[-1]['recall_filtered']:.3f})")
+        finally:
+            if backend is not exact:
+                backend.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark retrieval latency, throughput and recall on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Corpus sizes to generate')
+    parser.add_argument('--backends', nargs='+', default=['memory'], choices=['memory', 'postgres', 'sharded'], help='Retrieval paths to run')
+    parser.add_argument('--dsn', help='Postgres DSN for the postgres backend (a scratch schema is created per size)')
+    parser.add_argument('--shards', type=int, default=4, help='Local shard processes for the sharded backend')
+    parser.add_argument('--shard-timeout-ms', type=float, default=1000, help='Per-query deadline for the sharded backend')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per measurement')
+    parser.add_argument('--k', type=int, default=16, help='Images per query, as in create_moodboard')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Concurrent client threads')
+    parser.add_argument('--filter-ratio', type=float, default=0.2, help='Fraction of queries filtered by domain')
+    parser.add_argument('--tag-ratio', type=float, default=0.1, help='Fraction of queries filtered by a required style tag')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    if 'postgres' in args.backends and not args.dsn:
+        parser.error('--dsn is required for the postgres backend')
+
+    rows = []
+    for size in args.sizes:
+        rows.extend(run_benchmark(size, args.backends, args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nWrote {len(rows)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# sharded_retrieval.py
+import os
+import time
+import heapq
+import queue
+import socket
+import struct
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Connection, answer_challenge, deliver_challenge
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import metrics
+from tag_index import TagIndex
+from config import SHARD_ADDRESSES, SHARD_AUTHKEY, SHARD_TIMEOUT_MS, SHARD_MIN_RESPONSES
+
+def parse_addresses(value):
+    """'host:port,host:port' -> [(host, port), ...]"""
+    addresses = []
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            host, port = item.rsplit(':', 1)
+            addresses.append((host, int(port)))
+    return addresses
+
+def require_authkey(authkey=None):
+    """
+    The shard protocol (multiprocessing.connection) unpickles every message it
+    receives, so anyone who can connect without the key can run code on the
+    shard host. There is deliberately no default key.
+    """
+    authkey = authkey or SHARD_AUTHKEY
+    if not authkey:
+        raise RuntimeError("SHARD_AUTHKEY must be set to a long random secret shared by the coordinator and shard servers")
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+def set_io_timeout(conn, seconds):
+    """
+    Bound blocking reads and writes on a Connection's socket (0 disables),
+    without switching the descriptor to non-blocking mode as settimeout() would
+    """
+    sock = socket.socket(fileno=os.dup(conn.fileno()))
+    try:
+        timeval = struct.pack('ll', int(seconds), int(seconds % 1 * 1e6))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+    finally:
+        sock.close()
+
+def load_postgres_shard(shard_index, num_shards):
+    """This shard's slice of image_embeddings, kept current by the change feed"""
+    from embedding_feed import start_live_index
+    index, _ = start_live_index(shard_index=shard_index, num_shards=num_shards)
+    return index
+
+def load_synthetic_shard(shard_index, num_shards, size, seed):
+    """
+    This shard's slice of the retrieval_benchmark corpus for (size, seed).
+    Every shard regenerates the same corpus and keeps rows position % num_shards.
+    """
+    import numpy as np
+    from retrieval_benchmark import EMBEDDING_DIM, generate_embeddings, generate_metadata
+    from vector_index import InMemoryVectorIndex
+    rng = np.random.default_rng(seed + size)
+    embeddings, _ = generate_embeddings(rng, size)
+    metadata = generate_metadata(rng, size)
+    index = InMemoryVectorIndex(EMBEDDING_DIM)
+    index.add(
+        [m['id'] for m in metadata[shard_index::num_shards]],
+        embeddings[shard_index::num_shards],
+        metadata[shard_index::num_shards]
+    )
+    return index
+
+def _serve_connection(conn, index, shard_index, authkey, handshake_timeout):
+    with conn:
+        # The handshake runs here rather than in the accept loop, so a slow or
+        # stalled client can't hold up everyone else's connections
+        try:
+            set_io_timeout(conn, handshake_timeout)
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+            set_io_timeout(conn, 0)
+        except (OSError, EOFError, multiprocessing.AuthenticationError):
+            return
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                images = index.search(
+                    request['query'],
+                    request['k'],
+                    domain=request.get('domain'),
+                    subcategory=request.get('subcategory'),
+                    required_tags=request.get('required_tags'),
+                    boost_tags=request.get('boost_tags')
+                )
+                response = {'shard': shard_index, 'images': images}
+            except Exception as e:
+                response = {'shard': shard_index, 'error': str(e)}
+            try:
+                conn.send(response)
+            except (EOFError, OSError):
+                return
+
+def serve_shard(shard_index, num_shards, address, authkey=None, synthetic=None, ready=None, backlog=128, handshake_timeout=5.0):
+    """
+    Load one shard into an InMemoryVectorIndex and answer top-k requests on
+    `address` (port 0 picks a free port). Each coordinator connection gets a
+    thread (which also runs the authentication handshake); searches share the
+    index's read lock and numpy releases the GIL during scoring, so concurrent
+    queries overlap. `ready`, if given, is a Connection that receives the bound
+    address once the shard is serving.
+    """
+    authkey = require_authkey(authkey)
+    start = time.time()
+    if synthetic:
+        index = load_synthetic_shard(shard_index, num_shards, *synthetic)
+    else:
+        index = load_postgres_shard(shard_index, num_shards)
+    # No authkey on the Listener: accept() would otherwise run each handshake inline
+    listener = Listener(address, backlog=backlog)
+    address = listener.address
+    print(f"Shard {shard_index}/{num_shards}: {len(index)} vectors, listening on {address[0]}:{address[1]} "
+          f"(loaded in {time.time() - start:.1f}s)")
+    if ready is not None:
+        ready.send(address)
+        ready.close()
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            continue
+        threading.Thread(
+            target=_serve_connection,
+            args=(conn, index, shard_index, authkey, handshake_timeout),
+            daemon=True
+        ).start()
+
+class ShardClient:
+    """
+    Authenticated connections to one shard server; a connection carries one
+    request at a time. Opening a connection (TCP connect plus the HMAC
+    handshake) is bounded by the caller's deadline, and warm() opens
+    connections ahead of time so queries rarely pay for it.
+    """
+
+    def __init__(self, address, authkey, retry_seconds=1.0):
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.retry_seconds = retry_seconds
+        self.idle = queue.LifoQueue()
+        self.down_until = 0.0
+
+    def connect(self, timeout):
+        if timeout <= 0:
+            raise TimeoutError(f"no time left to connect to shard {self.address[0]}:{self.address[1]}")
+        try:
+            sock = socket.create_connection(self.address, timeout=timeout)
+        except (ConnectionRefusedError, socket.gaierror):
+            # Don't make every query pay a connect attempt to a dead shard
+            self.down_until = time.monotonic() + self.retry_seconds
+            raise
+        sock.setblocking(True)
+        conn = Connection(sock.detach())
+        try:
+            set_io_timeout(conn, timeout)
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+            set_io_timeout(conn, 0)
+        except BlockingIOError:
+            # SO_RCVTIMEO expired mid-handshake
+            conn.close()
+            raise TimeoutError(f"handshake with shard {self.address[0]}:{self.address[1]} timed out") from None
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def warm(self, count, timeout=5.0):
+        """Open up to `count` connections in the background and park them as idle"""
+        def run():
+            for _ in range(count - self.idle.qsize()):
+                try:
+                    self.release(self.connect(timeout))
+                except (OSError, EOFError, multiprocessing.AuthenticationError):
+                    return
+        threading.Thread(target=run, name=f"shard-warm-{self.address[1]}", daemon=True).start()
+
+    def acquire(self, deadline):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        if time.monotonic() < self.down_until:
+            raise ConnectionError(f"shard {self.address[0]}:{self.address[1]} is marked down")
+        return self.connect(deadline - time.monotonic())
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    def query(self, request, deadline):
+        conn = self.acquire(deadline)
+        try:
+            conn.send(request)
+            if not conn.poll(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"shard {self.address[0]}:{self.address[1]} timed out")
+            response = conn.recv()
+        except BaseException:
+            # A late answer would be read by the next request, so the connection is dropped
+            conn.close()
+            raise
+        self.release(conn)
+        return response
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class ShardedRetriever:
+    """
+    Coordinator for scatter-gather search: each query embedding is sent to
+    every shard, each shard returns its own top-k, and the results are merged
+    into the global top-k. Shards that fail or miss the deadline are left out
+    and reported, so a slow or dead shard degrades recall instead of failing
+    the request. Fewer than min_responses answers raises TimeoutError.
+
+    Implements the InMemoryVectorIndex.search signature, so it can be passed
+    to ImageRetriever / create_moodboard as `index`.
+    """
+
+    def __init__(self, addresses, authkey=None, timeout_ms=SHARD_TIMEOUT_MS, min_responses=SHARD_MIN_RESPONSES,
+                 max_concurrency=64, warm_connections=8):
+        self.clients = [ShardClient(address, authkey) for address in addresses]
+        self.timeout = timeout_ms / 1000
+        self.min_responses = min_responses
+        self.executor = ThreadPoolExecutor(max_workers=len(self.clients) * max_concurrency)
+        for client in self.clients:
+            client.warm(warm_connections)
+
+    def _query_shard(self, client, request, deadline):
+        start = time.perf_counter()
+        response = client.query(request, deadline)
+        metrics.histogram('shard_query').observe(time.perf_counter() - start)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['images']
+
+    def search_shards(self, query, k=16, domain=None, subcategory=None, required_tags=None, boost_tags=None):
+        """Returns {'images', 'shards', 'answered', 'missing': {shard index: reason}}"""
+        request = {
+            'query': query, 'k': k, 'domain': domain, 'subcategory': subcategory,
+            'required_tags': required_tags, 'boost_tags': boost_tags
+        }
+        deadline = time.monotonic() + self.timeout
+        futures = {
+            self.executor.submit(self._query_shard, client, request, deadline): shard
+            for shard, client in enumerate(self.clients)
+        }
+        # Small grace period so shards that answer right at the deadline still count
+        done, not_done = wait(futures, timeout=self.timeout + 0.05)
+
+        results, missing = [], {}
+        for future in done:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                missing[futures[future]] = f"{type(e).__name__}: {e}"
+        for future in not_done:
+            missing[futures[future]] = 'TimeoutError'
+
+        if missing:
+            print(f"Sharded search: {len(missing)}/{len(self.clients)} shards missing ({missing})")
+        if len(results) < min(self.min_responses, len(self.clients)):
+            raise TimeoutError(f"only {len(results)}/{len(self.clients)} shards answered")
+
+        images = heapq.nlargest(k, (image for result in results for image in result), key=lambda image: image['similarity'])
+        return {'images': images, 'shards': len(self.clients), 'answered': len(results), 'missing': missing}
+
+    def search(self, query, k=16, domain=None, subcategory=None, required_tags=None, boost_tags=None):
+        return self.search_shards(query, k, domain, subcategory, required_tags, boost_tags)['images']
+
+    def suggest_styles(self, images, limit=3):
+        """Style suggestions from the tags on search results (shard indexes are not reachable from here)"""
+        tags = TagIndex()
+        for position, image in enumerate(images):
+            tags.add(position, image.get('tags'))
+        return tags.suggest_styles(limit=limit)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for client in self.clients:
+            client.close()
+
+def start_local_shards(num_shards, host='127.0.0.1', base_port=0, authkey=None, synthetic=None):
+    """
+    Spawn one shard server process per shard on this host; returns (addresses, processes).
+    With base_port=0 each shard binds a free port, so concurrent runs never collide.
+    """
+    authkey = require_authkey(authkey)
+    context = multiprocessing.get_context('spawn')
+    processes, pipes = [], []
+    for shard in range(num_shards):
+        address = (host, base_port + shard if base_port else 0)
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=serve_shard,
+            args=(shard, num_shards, address, authkey, synthetic, sender),
+            name=f"retrieval-shard-{shard}",
+            daemon=True
+        )
+        process.start()
+        sender.close()
+        processes.append(process)
+        pipes.append(receiver)
+    addresses = []
+    for shard, (process, receiver) in enumerate(zip(processes, pipes)):
+        while not receiver.poll(1):
+            if not process.is_alive():
+                raise RuntimeError(f"shard {shard} exited during startup")
+        try:
+            addresses.append(tuple(receiver.recv()))
+        except EOFError:
+            raise RuntimeError(f"shard {shard} exited during startup")
+        receiver.close()
+    return addresses, processes
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve one retrieval shard, or every shard of this host')
+    parser.add_argument('--num-shards', type=int, required=True, help='Shards across all hosts')
+    parser.add_argument('--shard', type=int, nargs='*', help='Shard indexes to serve here (default: all)')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (only expose shards on a private network)')
+    parser.add_argument('--base-port', type=int, default=7100, help='Shard i listens on base-port + i')
+    parser.add_argument('--synthetic', type=int, metavar='SIZE', help='Serve a synthetic retrieval_benchmark corpus instead of Postgres')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for --synthetic')
+    args = parser.parse_args()
+
+    authkey = require_authkey()
+    shards = args.shard if args.shard else range(args.num_shards)
+    synthetic = (args.synthetic, args.seed) if args.synthetic else None
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=serve_shard,
+            args=(shard, args.num_shards, (args.host, args.base_port + shard), authkey, synthetic),
+            name=f"retrieval-shard-{shard}"
+        )
+        for shard in shards
+    ]
+    for process in processes:
+        process.start()
+    print("Shard addresses: SHARD_ADDRESSES=" + ','.join(f"<host>:{args.base_port + shard}" for shard in shards))
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# tag_index.py
+import re
+import bisect
+
+STYLE_KEYWORDS = ['vintage', 'modern', 'minimal', 'cinematic', 'abstract']
+
+# Must stay in sync with the SQL that fills images.tag_tokens (see db_manager.py)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def tag_title(tag):
+    """Unsplash tags are stored as {'type': ..., 'title': ...}; older rows may be plain strings"""
+    return tag.get('title', '') if isinstance(tag, dict) else str(tag)
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+def normalize_tag_tokens(tags):
+    """Distinct lowercase alphanumeric tokens across all tag titles"""
+    tokens = set()
+    for tag in tags or []:
+        tokens.update(tokenize(tag_title(tag)))
+    return sorted(tokens)
+
+def validate_tag_filter(tags):
+    """A request's "tags" field must be omitted or a list of strings; a bare string would match per character"""
+    if tags is None:
+        return None
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+    return tags
+
+class TagIndex:
+    """Inverted index from normalized tag tokens to document keys (image ids or index positions)"""
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_tokens = {}
+        self._vocabulary = None
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def add(self, key, tags):
+        tokens = normalize_tag_tokens(tags)
+        self.remove(key)
+        self.doc_tokens[key] = tokens
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                self.postings[token] = posting = set()
+                self._vocabulary = None
+            posting.add(key)
+
+    def remove(self, key):
+        for token in self.doc_tokens.pop(key, ()):
+            posting = self.postings[token]
+            posting.discard(key)
+            if not posting:
+                del self.postings[token]
+                self._vocabulary = None
+
+    def lookup(self, token):
+        return self.postings.get(token, set())
+
+    def match_all(self, tags):
+        """Keys tagged with every token of `tags` (strings), smallest posting list first"""
+        tokens = sorted({t for tag in tags for t in tokenize(tag)}, key=lambda t: len(self.lookup(t)))
+        if not tokens:
+            return None
+        result = set(self.lookup(tokens[0]))
+        for token in tokens[1:]:
+            if not result:
+                break
+            result &= self.lookup(token)
+        return result
+
+    def prefix_tokens(self, prefix):
+        """Vocabulary tokens starting with `prefix` (e.g. 'minimal' -> 'minimalism', 'minimalist')"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        tokens = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+        return tokens
+
+    def suggest_styles(self, keys=None, keywords=STYLE_KEYWORDS, limit=3):
+        """
+        Style tokens found on `keys` (all documents if None), most common first,
+        from posting-list lookups of tokens prefixed by each style keyword.
+        """
+        keys = set(keys) if keys is not None else None
+        counts = {}
+        for keyword in keywords:
+            for token in self.prefix_tokens(keyword):
+                posting = self.postings[token]
+                count = len(posting & keys) if keys is not None else len(posting)
+                if count:
+                    counts[token] = count
+        return sorted(counts, key=lambda token: (-counts[token], token))[:limit]
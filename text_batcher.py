@@ -0,0 +1,70 @@
+# text_batcher.py
+import time
+import threading
+from concurrent.futures import Future
+from metrics import metrics
+
+class TextEncodeBatcher:
+    """
+    Serving-side dispatcher for CLIP text encodes.
+
+    Concurrent requests for the same prompt share one in-flight computation
+    (single-flight). Distinct prompts arriving within max_wait_ms of the first
+    queued one are packed into a single batched forward pass of at most
+    max_batch_size prompts, so no request waits longer than max_wait_ms for
+    its batch to start.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait_ms=5):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.inflight = {}
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self._run, name='text-encode-batcher', daemon=True)
+        self.worker.start()
+
+    def encode(self, text):
+        """Return the embedding for `text`, blocking until its batch has run"""
+        with self.condition:
+            future = self.inflight.get(text)
+            if future is None:
+                future = Future()
+                self.inflight[text] = future
+                self.pending.append(text)
+                self.condition.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch_size]
+            del self.pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                embeddings = self.encode_batch(batch)
+                results = [(text, embedding, None) for text, embedding in zip(batch, embeddings)]
+            except Exception as e:
+                results = [(text, None, e) for text in batch]
+            metrics.histogram('encode_text_batch').observe(time.perf_counter() - start)
+
+            with self.condition:
+                futures = [self.inflight.pop(text) for text in batch]
+            for future, (_, embedding, error) in zip(futures, results):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(embedding)
@@ -5,9 +5,10 @@ import requests
 from config import UNSPLASH_ACCESS_KEY, RATE_LIMIT_PER_HOUR, PHOTOS_PER_PAGE
 
 class UnsplashClient:
-    def __init__(self):
-        self.api_key = UNSPLASH_ACCESS_KEY
-        self.base_url = "https://api.unsplash.com"
+    def __init__(self, api_key=None, base_url="https://api.unsplash.com", rate_limit_per_hour=RATE_LIMIT_PER_HOUR):
+        self.api_key = api_key or UNSPLASH_ACCESS_KEY
+        self.base_url = base_url
+        self.rate_limit_per_hour = rate_limit_per_hour
         self.request_timestamps = []
         
     def _respect_rate_limit(self):
@@ -16,20 +17,20 @@ class UnsplashClient:
         # Remove timestamps older than 1 hour
         self.request_timestamps = [ts for ts in self.request_timestamps if current_time - ts < 3600]
         
-        if len(self.request_timestamps) >= RATE_LIMIT_PER_HOUR:
+        if len(self.request_timestamps) >= self.rate_limit_per_hour:
             wait_time = 3600 - (current_time - self.request_timestamps[0]) + 1
             print(f"Rate limit approached. Waiting {wait_time:.2f} seconds...")
             time.sleep(wait_time)
             
         self.request_timestamps.append(time.time())
         
-    def search_photos(self, query, page=1, per_page=PHOTOS_PER_PAGE, orientation=None):
-        """Search for photos with given query and pagination"""
+    def search_photos(self, query, page=1, per_page=PHOTOS_PER_PAGE, orientation=None, vary_query=True):
+        """Search for photos with given query and pagination (vary_query randomly drops query terms)"""
         self._respect_rate_limit()
         
         try:
             # Add some randomness to the query to increase diversity
-            if random.random() < 0.3 and " " in query:
+            if vary_query and random.random() < 0.3 and " " in query:
                 terms = query.split()
                 query = " ".join(random.sample(terms, max(1, len(terms) - 1)))
             
@@ -57,7 +58,7 @@ class UnsplashClient:
         except Exception as e:
             print(f"Error searching photos for '{query}': {str(e)}")
             time.sleep(5)  # Wait before retrying
-            return {"results": []}
+            return {"results": [], "error": str(e)}
         
     def get_photo_data(self, photo_id):
         """Get detailed data for a specific photo"""
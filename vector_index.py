@@ -0,0 +1,223 @@
+# vector_index.py
+import threading
+import numpy as np
+from contextlib import contextmanager
+from tag_index import TagIndex, tokenize
+
+class ReadWriteLock:
+    """Shared lock for searches, exclusive for add/remove; waiting writers block new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+class InMemoryVectorIndex:
+    """
+    Exact cosine-similarity search over unit-normalized vectors held in memory.
+    search() returns dicts shaped like ImageRetriever.find_similar_images results.
+    Searches run concurrently; add() and remove() (see embedding_feed.py) take
+    the lock exclusively.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.ids = []
+        self.metadata = []
+        # Preallocated buffers, grown geometrically so repeated add() calls stay cheap
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._domains = np.empty(0, dtype=object)
+        self._subcategories = np.empty(0, dtype=object)
+        # Tag tokens -> row positions, for tag prefilters, boosts and style suggestions
+        self.tags = TagIndex()
+        self.positions = {}
+        self.lock = ReadWriteLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def vectors(self):
+        return self._vectors[:len(self.ids)]
+
+    def _reserve(self, size):
+        capacity = len(self._vectors)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        for name in ('_vectors', '_domains', '_subcategories'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(self.ids)] = old[:len(self.ids)]
+            setattr(self, name, new)
+
+    def _set_row(self, position, vector, meta):
+        self._vectors[position] = vector
+        self._domains[position] = meta['domain']
+        self._subcategories[position] = meta['subcategory']
+        self.metadata[position] = meta
+        self.tags.add(position, meta.get('tags'))
+
+    def add(self, ids, vectors, metadata):
+        """
+        Add vectors with their ids and metadata (dicts with domain, subcategory,
+        urls, colors, tags). Ids already in the index are replaced in place.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        with self.lock.write():
+            new = [i for i, image_id in enumerate(ids) if image_id not in self.positions]
+            if len(new) < len(ids):
+                for i, image_id in enumerate(ids):
+                    if image_id in self.positions:
+                        self._set_row(self.positions[image_id], vectors[i], metadata[i])
+                ids = [ids[i] for i in new]
+                vectors = vectors[new]
+                metadata = [metadata[i] for i in new]
+
+            start = len(self.ids)
+            end = start + len(vectors)
+            self._reserve(end)
+            self._vectors[start:end] = vectors
+            self._domains[start:end] = [m['domain'] for m in metadata]
+            self._subcategories[start:end] = [m['subcategory'] for m in metadata]
+            for position, (image_id, meta) in enumerate(zip(ids, metadata), start):
+                self.tags.add(position, meta.get('tags'))
+                self.positions[image_id] = position
+            self.ids.extend(ids)
+            self.metadata.extend(metadata)
+
+    def remove(self, ids):
+        """Remove ids (unknown ones are ignored) by moving the last row into each freed slot"""
+        removed = 0
+        with self.lock.write():
+            for image_id in ids:
+                position = self.positions.pop(image_id, None)
+                if position is None:
+                    continue
+                last = len(self.ids) - 1
+                self.tags.remove(last)
+                if position != last:
+                    moved_id = self.ids[last]
+                    self.ids[position] = moved_id
+                    self.positions[moved_id] = position
+                    self._set_row(position, self._vectors[last], self.metadata[last])
+                self.ids.pop()
+                self.metadata.pop()
+                removed += 1
+        return removed
+
+    def search_ids(self, query, k=16, domain=None, subcategory=None, required_tags=None, boost_tags=None, boost_weight=0.05):
+        """
+        Return (positions, similarities) of the top-k rows, best first.
+        required_tags restricts the search to rows carrying every tag token
+        (a posting-list intersection, so no vectors outside it are scored);
+        boost_tags adds boost_weight to the score for each matching token.
+        """
+        query = self._normalize_query(query)
+        with self.lock.read():
+            return self._search_ids(query, k, domain, subcategory, required_tags, boost_tags, boost_weight)
+
+    @staticmethod
+    def _normalize_query(query):
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        return query / max(np.linalg.norm(query), 1e-12)
+
+    def _search_ids(self, query, k, domain, subcategory, required_tags, boost_tags, boost_weight):
+        candidates = None
+        if required_tags:
+            matched = self.tags.match_all(required_tags)
+            candidates = np.fromiter(matched, dtype=np.int64, count=len(matched)) if matched is not None else None
+            if candidates is not None:
+                candidates.sort()
+        if domain or subcategory:
+            size = len(self.ids)
+            if candidates is None:
+                candidates = np.arange(size)
+            mask = np.ones(len(candidates), dtype=bool)
+            if domain:
+                mask &= self._domains[candidates] == domain
+            if subcategory:
+                mask &= self._subcategories[candidates] == subcategory
+            candidates = candidates[mask]
+        scores = self.vectors[candidates] @ query if candidates is not None else self.vectors @ query
+
+        if boost_tags:
+            # candidates is sorted, so posting positions map to score rows by binary search
+            for token in {t for tag in boost_tags for t in tokenize(tag)}:
+                posting = self.tags.lookup(token)
+                hits = np.fromiter(posting, dtype=np.int64, count=len(posting))
+                if candidates is not None:
+                    rows = np.searchsorted(candidates, hits)
+                    in_range = rows < len(candidates)
+                    rows, hits = rows[in_range], hits[in_range]
+                    hits = rows[candidates[rows] == hits]
+                scores[hits] += boost_weight
+
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = candidates[top] if candidates is not None else top
+        return positions, scores[top]
+
+    def search(self, query, k=16, domain=None, subcategory=None, required_tags=None, boost_tags=None, boost_weight=0.05):
+        """Find the k most similar images to a query embedding"""
+        query = self._normalize_query(query)
+        # The read lock is not reentrant (a waiting writer would block it), so call _search_ids directly
+        with self.lock.read():
+            positions, similarities = self._search_ids(
+                query, k, domain, subcategory, required_tags, boost_tags, boost_weight
+            )
+            images = []
+            for position, similarity in zip(positions, similarities):
+                meta = self.metadata[position]
+                images.append({
+                    'id': self.ids[position],
+                    'domain': meta['domain'],
+                    'subcategory': meta['subcategory'],
+                    'urls': meta['urls'],
+                    'colors': meta['colors'],
+                    'tags': meta['tags'],
+                    'similarity': float(similarity)
+                })
+        return images
+
+    def suggest_styles(self, images, limit=3):
+        """Style suggestions for search results, from tag posting lists"""
+        with self.lock.read():
+            positions = [self.positions[image['id']] for image in images if image['id'] in self.positions]
+            return self.tags.suggest_styles(positions, limit=limit)
@@ -0,0 +1,80 @@
+# vector_store.py
+import numpy as np
+
+EMBEDDING_DIM = 512  # ViT-B/32
+VECTOR_BACKENDS = ('pgvector', 'bytea')
+
+def normalize(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+def to_vector_literal(embedding):
+    """Unit-normalize and format as a pgvector text literal"""
+    return '[' + ','.join(f"{value:.7g}" for value in normalize(embedding)) + ']'
+
+def query_param(embedding, backend='pgvector'):
+    if backend == 'pgvector':
+        return to_vector_literal(embedding)
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def similarity_select(backend='pgvector', exact=False):
+    """
+    SQL fragments (similarity expression, ORDER BY expression) for a query
+    embedding passed as a single %s parameter. With pgvector, vectors are unit
+    length, so negative inner product orders exactly like cosine distance and
+    is served by the HNSW index.
+    """
+    if backend == 'pgvector' and not exact:
+        return "-(e.embedding_vec <#> %s::vector) AS similarity", "e.embedding_vec <#> %s::vector"
+    # Ordering by the select alias can't use the HNSW index, so this is an exact scan of the matching rows
+    select = "-(e.embedding_vec <#> %s::vector) AS similarity" if backend == 'pgvector' else "cosine_similarity(e.embedding, %s) AS similarity"
+    return select, "similarity DESC"
+
+def similarity_conditions(backend='pgvector'):
+    """
+    WHERE conditions the similarity fragments need: rows written before
+    migrate_embeddings.py (or while VECTOR_SEARCH_BACKEND was still 'bytea')
+    have no vector yet and would otherwise score NULL.
+    """
+    if backend == 'pgvector':
+        return ["e.embedding_vec IS NOT NULL"]
+    return []
+
+def similarity_params(embedding, backend='pgvector', exact=False):
+    """(SELECT params, ORDER BY params) matching the fragments from similarity_select"""
+    param = query_param(embedding, backend)
+    return [param], ([param] if backend == 'pgvector' and not exact else [])
+
+def use_exact_scan(backend, filtered):
+    """
+    HNSW applies WHERE filters after the index scan (at most ef_search
+    candidates), so filtered pgvector queries scan the filtered rows exactly
+    """
+    return backend == 'pgvector' and filtered
+
+def ensure_vector_schema(cursor, dim=EMBEDDING_DIM):
+    """
+    Add the pgvector column for unit-normalized embeddings. The HNSW index is
+    created here only while the table is empty; on an existing catalogue it is
+    built CONCURRENTLY by migrate_embeddings.py after the backfill.
+    """
+    cursor.execute(f"""
+    CREATE EXTENSION IF NOT EXISTS vector;
+    ALTER TABLE image_embeddings ADD COLUMN IF NOT EXISTS embedding_vec vector({dim});
+    """)
+    cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM image_embeddings)")
+    if cursor.fetchone()[0]:
+        cursor.execute(create_index_sql())
+
+def create_index_sql(concurrently=False, m=16, ef_construction=64):
+    return f"""
+    CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS idx_image_embeddings_vec
+        ON image_embeddings USING hnsw (embedding_vec vector_ip_ops)
+        WITH (m = {int(m)}, ef_construction = {int(ef_construction)})
+    """
+
+def set_search_params(conn, ef_search):
+    """Session-level HNSW search breadth (higher means better recall, slower queries)"""
+    with conn.cursor() as cursor:
+        cursor.execute("SET hnsw.ef_search = %s", (int(ef_search),))
+    conn.commit()